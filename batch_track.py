@@ -0,0 +1,204 @@
+import argparse
+import bisect
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import List
+
+import cv2
+import numpy as np
+import pandas as pd
+
+from point_tracker import track_points
+from run_files import run_filename, run_number_of
+from seek_index import FrameIndex, load_or_build_index, seek_exact
+
+RUN_KEY = ['section', 'v_flow', 'run']
+OUTPUT_COLUMNS = ['section', 'v_flow', 'run', 'x', 'y', 'timestamp', 'frame', 'source', 'confidence']
+
+# Per-process state set up by `_init_worker`
+_video_path = None
+_frame_index = None
+
+
+# Load the (persisted) frame index once per worker process
+def _init_worker(video_path: str):
+    global _video_path, _frame_index
+    _video_path = video_path
+    _frame_index = load_or_build_index(video_path)
+
+
+# Turn seed rows into tracking segments. Each seed is tracked until the next seed of the same run,
+# its own `end_timestamp` (if the column is present), or the end of the video.
+def build_segments(seeds: pd.DataFrame, frame_index: FrameIndex) -> List[dict]:
+    segments = []
+    for _, group in seeds.groupby(RUN_KEY, sort=False):
+        rows = group.sort_values('timestamp').to_dict('records')
+        starts = [frame_index.index_at(row['timestamp']) for row in rows]
+        for i, row in enumerate(rows):
+            end = starts[i + 1] if i + 1 < len(rows) else len(frame_index)
+            if pd.notna(row.get('end_timestamp', np.nan)):
+                end = min(end, frame_index.index_at(row['end_timestamp']) + 1)
+            segments.append({
+                'section': row['section'],
+                'v_flow': row['v_flow'],
+                'run': row['run'],
+                'x': float(row['x']),
+                'y': float(row['y']),
+                'start': starts[i],
+                'end': max(end, starts[i] + 1),
+            })
+    return segments
+
+
+# First frame of each chunk: roughly every `chunk_seconds`, moved back onto a keyframe so
+# every chunk can be decoded independently
+def chunk_starts(frame_index: FrameIndex, chunk_seconds: float) -> List[int]:
+    step = max(int(chunk_seconds * frame_index.fps), 1)
+    starts = set()
+    for frame in range(0, max(len(frame_index), 1), step):
+        keyframe = frame_index.keyframe_before(frame)
+        starts.add(frame if keyframe is None else keyframe)
+    return sorted(starts)
+
+
+# Group segments by the chunk their seed falls in. A segment is not split at chunk boundaries: tracking
+# needs the position on the previous frame, so a segment is tracked by one worker from its seed to its end.
+def assign_chunks(segments: List[dict], starts: List[int]) -> List[List[dict]]:
+    chunks = [[] for _ in starts]
+    for segment in segments:
+        chunks[max(bisect.bisect_right(starts, segment['start']) - 1, 0)].append(segment)
+    return [chunk for chunk in chunks if chunk]
+
+
+def _row(segment: dict, x: float, y: float, frame: int, source: str, confidence: float) -> dict:
+    return {
+        'section': segment['section'],
+        'v_flow': segment['v_flow'],
+        'run': segment['run'],
+        'x': round(x, 1),
+        'y': round(y, 1),
+        'timestamp': _frame_index.pts_at(frame),
+        'frame': frame,
+        'source': source,
+        'confidence': round(confidence, 3),
+    }
+
+
+# Track every segment of one chunk in a single forward decoding pass (runs in a worker process).
+# A segment stops early when its confidence drops below `min_confidence`.
+def track_chunk(segments: List[dict], min_confidence: float, patch_radius: int) -> List[dict]:
+    pending = sorted(segments, key=lambda segment: segment['start'])
+    last = max(segment['end'] for segment in pending)
+    gop = max(int(_frame_index.fps), 1)
+
+    cap = cv2.VideoCapture(_video_path)
+    frame = pending[0]['start']
+    seek_exact(cap, _frame_index, frame)
+
+    rows = []
+    active = []
+    previous = None
+    while frame < last and (active or pending):
+        # Nothing to track until the next seed: seek across long idle gaps instead of decoding them
+        if not active and pending[0]['start'] - frame > gop:
+            seek_exact(cap, _frame_index, pending[0]['start'], frame)
+            frame = pending[0]['start']
+            previous = None
+
+        ret, image = cap.read()
+        if not ret:
+            break
+
+        if previous is not None:
+            still_active = []
+            for segment in active:
+                if frame >= segment['end']:
+                    continue
+                point, confidence = track_points(previous, image, segment['point'], patch_radius)
+                if confidence[0] < min_confidence:
+                    print(f"{segment['section']} {segment['v_flow']} {segment['run']}: "
+                          f"tracking lost at frame {frame} (confidence {confidence[0]:.2f})")
+                    continue
+                segment['point'] = point
+                rows.append(_row(segment, point[0, 0], point[0, 1], frame, 'auto', float(confidence[0])))
+                still_active.append(segment)
+            active = still_active
+
+        # Start the segments seeded on this frame
+        while pending and pending[0]['start'] <= frame:
+            segment = pending.pop(0)
+            segment['point'] = np.array([[segment['x'], segment['y']]], np.float32)
+            rows.append(_row(segment, segment['x'], segment['y'], frame, 'manual', 1.0))
+            active.append(segment)
+
+        previous = image
+        frame += 1
+
+    cap.release()
+    return rows
+
+
+# Join the chunk results back into one trajectory per run. Seeds win over tracked points on the same frame.
+def stitch(rows: List[dict]) -> pd.DataFrame:
+    df = pd.DataFrame(rows, columns=OUTPUT_COLUMNS)
+    df['_auto'] = df['source'] == 'auto'
+    df = df.sort_values(RUN_KEY + ['frame', '_auto'], kind='stable')
+    df = df.drop_duplicates(RUN_KEY + ['frame'], keep='first')
+    return df.drop(columns='_auto').reset_index(drop=True)
+
+
+# Write one CSV per run using the same filename convention as `save_data`
+def save_runs(df: pd.DataFrame, output_folder: str) -> List[str]:
+    os.makedirs(output_folder, exist_ok=True)
+    recorded_at = datetime.now()
+    paths = []
+    for (section, v_flow, run), run_df in df.groupby(RUN_KEY, sort=False):
+        path = os.path.join(output_folder, run_filename(section, v_flow, run_number_of(run), recorded_at))
+        run_df.to_csv(path, index=False)
+        paths.append(path)
+    return paths
+
+
+# Track all seeds of one video across a process pool and save the per-run trajectories
+def batch_track(video_path: str, seeds_path: str, output_folder: str = 'output_data', workers: int = None,
+                chunk_seconds: float = 60, min_confidence: float = 0.5, patch_radius: int = 64) -> List[str]:
+    frame_index = load_or_build_index(video_path)  # Built once here so the workers only load it
+    seeds = pd.read_csv(seeds_path)
+    segments = build_segments(seeds, frame_index)
+    chunks = assign_chunks(segments, chunk_starts(frame_index, chunk_seconds))
+    # Longest chunks first so the pool is not left waiting on a straggler
+    chunks.sort(key=lambda chunk: max(s['end'] for s in chunk) - min(s['start'] for s in chunk), reverse=True)
+    print(f"Tracking {len(segments)} segments in {len(chunks)} chunks")
+
+    rows = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(video_path,)) as pool:
+        futures = [pool.submit(track_chunk, chunk, min_confidence, patch_radius) for chunk in chunks]
+        for done, future in enumerate(as_completed(futures), 1):
+            rows.extend(future.result())
+            print(f"Chunk {done}/{len(futures)} done")
+
+    paths = save_runs(stitch(rows), output_folder)
+    for path in paths:
+        print(f"Data saved to {path}")
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Track seeded points through a video without a display.")
+    parser.add_argument('video', help="Video file to track")
+    parser.add_argument('seeds', help="CSV of seed points: section, v_flow, run, x, y, timestamp "
+                                      "[, end_timestamp]")
+    parser.add_argument('--output-folder', default='output_data')
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument('--chunk-seconds', type=float, default=60, help="Approximate length of a work chunk")
+    parser.add_argument('--min-confidence', type=float, default=0.5, help="Stop a track below this confidence")
+    parser.add_argument('--patch-radius', type=int, default=64, help="Search radius around each point in pixels")
+    args = parser.parse_args()
+
+    batch_track(args.video, args.seeds, args.output_folder, args.workers,
+                args.chunk_seconds, args.min_confidence, args.patch_radius)
+
+
+if __name__ == "__main__":
+    main()
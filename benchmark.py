@@ -0,0 +1,376 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+import cv2
+import numpy as np
+import pandas as pd
+import matplotlib
+matplotlib.use('Agg')  # Headless: the plot benchmark renders off-screen
+
+from click_journal import JOURNAL_FIELDS
+from compile_csv_files_with_selector import compile_csv_files, find_run_files
+from frame_reader import FrameReader
+from graph_multiple_runs_grid_with_selection import build_trajectory_grid
+from replay import default_max_gap, iter_replay_frames, plan_replay
+from run_files import run_filename
+from seek_index import FrameCache, load_or_build_index
+from storage import read_compiled
+from trajectory_index import TrajectoryIndex
+from transform_data import DEFAULT_CONFIG, transform_file
+from viewport import Viewport
+
+# Bump when benchmarks are added, removed or change what they measure
+BENCHMARK_VERSION = 1
+
+SECTIONS = ['Experiment_I', 'Experiment_II', 'Experiment_III']
+V_FLOWS = [15, 20, 25]
+BENCHMARKS = ['decode', 'seek', 'replay', 'compile', 'transform', 'plot']
+
+# Same as the defaults of the Point Marking Program
+REWIND_SECONDS = 5
+SKIP_FORWARD_SECONDS = 5
+VIEWPORT_SIZE = (1280, 720)
+
+
+# Write a synthetic test video of moving dots bouncing off the edges. Everything is seeded, so the
+# same settings always give the same video. `gop` is the requested keyframe interval: 1 writes all-intra
+# MJPG; otherwise it is passed to the MPEG-4 encoder, which not every OpenCV build honours (the
+# benchmark reports the interval the video actually has).
+def write_synthetic_video(path: str, width: int = 1280, height: int = 720, frames: int = 300, fps: float = 30.0,
+                          gop: int = 30, dots: int = 20, seed: int = 0) -> str:
+    fourcc = cv2.VideoWriter_fourcc(*('MJPG' if gop == 1 else 'mp4v'))
+    params = [cv2.VIDEOWRITER_PROP_KEY_INTERVAL, gop] if hasattr(cv2, 'VIDEOWRITER_PROP_KEY_INTERVAL') else []
+    writer = cv2.VideoWriter(path, cv2.CAP_FFMPEG, fourcc, fps, (width, height), params)
+    if not writer.isOpened():
+        writer = cv2.VideoWriter(path, fourcc, fps, (width, height))
+    if not writer.isOpened():
+        raise IOError(f"Could not open a video writer for {path}")
+
+    rng = np.random.default_rng(seed)
+    start = rng.random((dots, 2)) * (width, height)
+    velocity = rng.normal(0, 4, (dots, 2))
+    colors = rng.integers(64, 256, (dots, 3)).tolist()
+    background = rng.integers(0, 48, (height, width, 3), dtype=np.uint8)  # Texture, so frames do not compress to nothing
+    size = np.array([width, height])
+    for frame in range(frames):
+        # Reflect positions back into the frame to bounce off the edges
+        position = np.abs((start + velocity * frame) % (2 * size) - size)
+        position = size - position
+        image = background.copy()
+        for (x, y), color in zip(position.astype(int), colors):
+            cv2.circle(image, (int(x), int(y)), 8, color, -1)
+        cv2.putText(image, str(frame), (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+        writer.write(image)
+    writer.release()
+    return path
+
+
+# Write synthetic per-run CSVs (random-walk trajectories) following the <section>_<v_flow>_Run_<n>_<timestamp>.csv
+# convention; returns the paths. Seeded, with fixed recording times, so the files are the same every time.
+def write_synthetic_runs(folder: str, runs_per_cell: int = 5, points_per_run: int = 200, fps: float = 30.0,
+                         seed: int = 0) -> List[str]:
+    os.makedirs(folder, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    recorded_at = datetime(2024, 1, 1)
+    paths = []
+    for section in SECTIONS:
+        for v_flow in V_FLOWS:
+            for run_number in range(1, runs_per_cell + 1):
+                start = int(rng.integers(0, 1000))
+                frames = start + np.arange(points_per_run)
+                run = pd.DataFrame({
+                    'section': section,
+                    'v_flow': v_flow,
+                    'run': f'Run_{run_number}',
+                    'x': np.round(960 + np.cumsum(rng.normal(0, 3, points_per_run)), 1),
+                    'y': np.round(540 + np.cumsum(rng.normal(0, 3, points_per_run)), 1),
+                    'timestamp': frames / fps,
+                    'frame': frames,
+                    'source': 'manual',
+                    'confidence': 1.0,
+                }, columns=JOURNAL_FIELDS)
+                recorded_at += timedelta(seconds=1)
+                path = os.path.join(folder, run_filename(section, v_flow, run_number, recorded_at))
+                run.to_csv(path, index=False)
+                paths.append(path)
+    return paths
+
+
+# Run `fn` `repeat` times and summarise the wall-clock seconds; `fn` may return a dict of extra values
+# (e.g. counts), which are taken from the last repetition
+def _measure(fn: Callable[[], Optional[dict]], repeat: int) -> dict:
+    times = []
+    extra = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        extra = fn()
+        times.append(time.perf_counter() - start)
+    result = {'seconds_median': statistics.median(times), 'seconds_min': min(times),
+              'seconds_max': max(times), 'repeat': repeat}
+    result.update(extra or {})
+    return result
+
+
+# Decode/display loop: frames pulled from the background reader and rendered through the viewport, as the
+# Point Marking Program does for every frame it shows
+def bench_decode(video_path: str, repeat: int) -> dict:
+    frame_index = load_or_build_index(video_path)
+    viewport = Viewport(*_video_size(video_path), max_size=VIEWPORT_SIZE)
+
+    def run():
+        cap = cv2.VideoCapture(video_path)
+        reader = FrameReader(cap, frame_index=frame_index).start()
+        frames = 0
+        while True:
+            frame = reader.get(timeout=5)
+            if frame is None:
+                break
+            viewport.render(frame.image)
+            frames += 1
+        reader.stop()
+        cap.release()
+        return {'frames': frames}
+
+    result = _measure(run, repeat)
+    result['fps'] = result['frames'] / result['seconds_median']
+    return result
+
+
+# Seek latency of `rewind_video` and `skip_forward_video`: time from the seek request until the target
+# frame is ready, from seeded random positions, with the same frame cache the Point Marking Program uses
+def bench_seek(video_path: str, repeat: int, seeks: int = 30, seed: int = 0) -> dict:
+    frame_index = load_or_build_index(video_path)
+    # Shorter jumps on videos too short for the real ones
+    rewind = min(int(REWIND_SECONDS * frame_index.fps), len(frame_index) // 3)
+    skip = min(int(SKIP_FORWARD_SECONDS * frame_index.fps), len(frame_index) // 3)
+    targets = np.random.default_rng(seed).integers(rewind, len(frame_index) - skip, seeks)
+    latencies = {'jump': [], 'rewind': [], 'skip': []}
+
+    def seek(reader: FrameReader, target: int, kind: str):
+        start = time.perf_counter()
+        reader.seek(target)
+        frame = reader.get(timeout=10)
+        latencies[kind].append(time.perf_counter() - start)
+        if frame is None or frame.index != target:
+            raise RuntimeError(f"Seek to frame {target} returned {None if frame is None else frame.index}")
+
+    def run():
+        cap = cv2.VideoCapture(video_path)
+        reader = FrameReader(cap, frame_index=frame_index, cache=FrameCache()).start()
+        try:
+            for target in targets.tolist():
+                seek(reader, target, 'jump')             # Somewhere new (a cold seek)
+                seek(reader, target - rewind, 'rewind')  # rewind_video
+                seek(reader, target, 'skip')             # skip_forward_video back to where it was
+        finally:
+            reader.stop()
+            cap.release()
+
+    result = _measure(run, repeat)
+    for kind, values in latencies.items():
+        result[f'{kind}_ms_median'] = 1000 * statistics.median(values)
+        result[f'{kind}_ms_p95'] = 1000 * float(np.percentile(values, 95))
+    result['seeks'] = seeks
+    return result
+
+
+# `replay_marked_points`: decode and draw every marked frame of a run in timestamp order
+def bench_replay(video_path: str, repeat: int, points: int = 200, seed: int = 0) -> dict:
+    frame_index = load_or_build_index(video_path)
+    width, height = _video_size(video_path)
+    viewport = Viewport(width, height, max_size=VIEWPORT_SIZE)
+    rng = np.random.default_rng(seed)
+    frames = np.sort(rng.integers(0, len(frame_index), points))
+    entries = [{'x': float(rng.random() * width), 'y': float(rng.random() * height), 'frame': int(frame),
+                'timestamp': frame_index.pts_at(int(frame))} for frame in frames]
+
+    def run():
+        cap = cv2.VideoCapture(video_path)
+        plan = plan_replay(entries, frame_index)
+        shown = 0
+        for _, image, frame_entries in iter_replay_frames(cap, frame_index, plan):
+            display_frame = viewport.render(image)
+            for entry in frame_entries:
+                cv2.circle(display_frame, viewport.to_view(entry['x'], entry['y']), 5, (0, 0, 255), -1)
+            shown += 1
+        cap.release()
+        return {'frames_shown': shown, 'points': points}
+
+    return _measure(run, repeat)
+
+
+# Compile throughput of the headless compile on the synthetic run CSVs
+def bench_compile(runs_folder: str, work_folder: str, repeat: int, output_format: str = 'csv') -> dict:
+    file_paths = find_run_files([runs_folder])
+    output_folder = os.path.join(work_folder, 'compiled')
+    outputs = []
+
+    def run():
+        shutil.rmtree(output_folder, ignore_errors=True)
+        with contextlib.redirect_stdout(io.StringIO()):
+            outputs.append(compile_csv_files(file_paths, output_folder, output_format=output_format))
+
+    result = _measure(run, repeat)
+    rows = len(read_compiled(outputs[-1]))
+    result.update(files=len(file_paths), rows=rows, rows_per_second=rows / result['seconds_median'],
+                  files_per_second=len(file_paths) / result['seconds_median'])
+    return result
+
+
+# `transform_data` throughput (the streamed transform with the default parameters)
+def bench_transform(compiled_path: str, work_folder: str, repeat: int) -> dict:
+    output_path = os.path.join(work_folder, 'transformed' + os.path.splitext(compiled_path)[1])
+    counts = []
+
+    def run():
+        counts.append(transform_file(compiled_path, output_path, DEFAULT_CONFIG['parameters']))
+
+    result = _measure(run, repeat)
+    result.update(rows=counts[-1], rows_per_second=counts[-1] / result['seconds_median'])
+    return result
+
+
+# Render time of the trajectory grid (formerly `plot_3x3_trajectories`) with every run selected, to PNG
+def bench_plot(compiled_path: str, repeat: int) -> dict:
+    index = TrajectoryIndex(read_compiled(compiled_path))
+    selection = {section: {v_flow: [key[2] for key in index.cell(section, v_flow)] for v_flow in index.v_flows}
+                 for section in index.sections}
+
+    def run():
+        fig = build_trajectory_grid(index, selection)
+        fig.savefig(io.BytesIO(), format='png')
+
+    result = _measure(run, repeat)
+    result.update(runs=len(index), points=len(index.df))
+    return result
+
+
+def _video_size(video_path: str):
+    cap = cv2.VideoCapture(video_path)
+    size = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    cap.release()
+    return size
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Generate the synthetic data in `work_folder` and run the selected benchmarks; returns the results document
+def run_benchmarks(work_folder: str, only: Optional[List[str]] = None, repeat: int = 3, width: int = 1280,
+                   height: int = 720, frames: int = 300, fps: float = 30.0, gop: int = 30, runs_per_cell: int = 5,
+                   points_per_run: int = 200, output_format: str = 'csv') -> dict:
+    only = only or BENCHMARKS
+    config = {'repeat': repeat, 'width': width, 'height': height, 'frames': frames, 'fps': fps, 'gop': gop,
+              'runs_per_cell': runs_per_cell, 'points_per_run': points_per_run, 'format': output_format}
+    results: Dict[str, dict] = {}
+
+    video_path = os.path.join(work_folder, f'synthetic_{width}x{height}_{frames}_gop{gop}.{"avi" if gop == 1 else "mp4"}')
+    if {'decode', 'seek', 'replay'} & set(only):
+        start = time.perf_counter()
+        write_synthetic_video(video_path, width, height, frames, fps, gop)
+        results['write_video'] = {'seconds': time.perf_counter() - start}
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            frame_index = load_or_build_index(video_path)
+        results['build_index'] = {'seconds': time.perf_counter() - start, 'frames': len(frame_index),
+                                  'keyframes': len(frame_index.keyframes or []), 'gop': default_max_gap(frame_index)}
+        if frame_index.keyframes and results['build_index']['gop'] != gop:
+            print(f"Note: the encoder used a keyframe interval of {results['build_index']['gop']}, not {gop}")
+
+    runs_folder = os.path.join(work_folder, 'runs')
+    compiled_path = None
+    if {'compile', 'transform', 'plot'} & set(only):
+        shutil.rmtree(runs_folder, ignore_errors=True)
+        write_synthetic_runs(runs_folder, runs_per_cell, points_per_run, fps)
+        with contextlib.redirect_stdout(io.StringIO()):
+            compiled_path = compile_csv_files(find_run_files([runs_folder]), os.path.join(work_folder, 'input'),
+                                              output_format=output_format)
+
+    benchmarks = {
+        'decode': lambda: bench_decode(video_path, repeat),
+        'seek': lambda: bench_seek(video_path, repeat),
+        'replay': lambda: bench_replay(video_path, repeat),
+        'compile': lambda: bench_compile(runs_folder, work_folder, repeat, output_format),
+        'transform': lambda: bench_transform(compiled_path, work_folder, repeat),
+        'plot': lambda: bench_plot(compiled_path, repeat),
+    }
+    for name in BENCHMARKS:
+        if name in only:
+            print(f"Running {name} ...")
+            results[name] = benchmarks[name]()
+
+    return {
+        'version': BENCHMARK_VERSION,
+        'commit': _git_commit(),
+        'run_at': datetime.now().isoformat(timespec='seconds'),
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'cpus': os.cpu_count(), 'numpy': np.__version__, 'pandas': pd.__version__,
+                        'opencv': cv2.__version__, 'matplotlib': matplotlib.__version__},
+        'config': config,
+        'results': results,
+    }
+
+
+# Print how every timing changed relative to an earlier results file
+def compare(previous: dict, current: dict):
+    for name, result in current['results'].items():
+        old = previous.get('results', {}).get(name, {})
+        for metric, value in result.items():
+            if metric in old and isinstance(value, float) and old[metric]:
+                print(f"{name}.{metric}: {old[metric]:.4g} -> {value:.4g} ({(value / old[metric] - 1) * 100:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the hot paths on synthetic videos and run CSVs (headless).")
+    parser.add_argument('--output', default='benchmark_results.json', help="JSON results file")
+    parser.add_argument('--compare', default=None, help="Earlier results file to compare against")
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, default=None, help="Benchmarks to run (default: all)")
+    parser.add_argument('--repeat', type=int, default=3, help="Repetitions per benchmark (the median is reported)")
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--frames', type=int, default=300, help="Length of the synthetic video in frames")
+    parser.add_argument('--fps', type=float, default=30.0)
+    parser.add_argument('--gop', type=int, default=30, help="Keyframe interval of the synthetic video")
+    parser.add_argument('--runs-per-cell', type=int, default=5, help="Synthetic runs per section and v_flow")
+    parser.add_argument('--points-per-run', type=int, default=200)
+    parser.add_argument('--format', default='csv', choices=['csv', 'parquet'], help="Compiled data format")
+    parser.add_argument('--work-folder', default=None, help="Keep the synthetic data here (default: a temp folder)")
+    args = parser.parse_args()
+
+    work_folder = args.work_folder or tempfile.mkdtemp(prefix='benchmark_')
+    os.makedirs(work_folder, exist_ok=True)
+    try:
+        document = run_benchmarks(work_folder, args.only, args.repeat, args.width, args.height, args.frames, args.fps,
+                                  args.gop, args.runs_per_cell, args.points_per_run, args.format)
+    finally:
+        if args.work_folder is None:
+            shutil.rmtree(work_folder, ignore_errors=True)
+
+    with open(args.output, 'w') as f:
+        json.dump(document, f, indent=2)
+    print(json.dumps(document['results'], indent=2))
+    print(f"Results saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), document)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,39 @@
+import bisect
 import cv2
-import pandas as pd
 import os
+import time
 import tkinter as tk
-from tkinter import messagebox
-from datetime import datetime
+from tkinter import filedialog, messagebox
+
+from click_journal import ClickJournal, recover_journal
+from frame_reader import FrameReader
+from playback_stats import PlaybackStats
+from point_index import PointIndex
+from point_tracker import PointPropagator
+from proxy_video import load_or_build_proxy, open_proxy, proxy_frame_index
+from replay import iter_replay_frames, load_replay_entries, plan_replay
+from run_files import run_filename
+from run_segmentation import load_or_segment
+from seek_index import FrameCache, load_or_build_index, seek_exact
+from viewport import OverlayLayer, Viewport
 
 # Path to the video file
 video_path = 'your_movie.mp4'
 
 # Initialize variables
 data = []
-scale_factor = 1.0
-frame_delay = 30  # Initial frame delay in ms (approx. 30 FPS)
+data_version = 0  # Bumped whenever `data` changes so the cached overlay gets redrawn
+scale_factor = 1.0  # Zoom level; 1.0 fits the whole frame in the viewport
+viewport_size = (1280, 720)  # Largest display window; zooming in crops instead of growing the window
+pan_step = 0.1  # Fraction of the viewport moved per pan key press
+frame_delay = 30  # Frame delay in ms; reset to the video's native frame interval once it is opened
 rewind_seconds = 5  # Rewind duration in seconds
 skip_forward_seconds = 5  # Forward skip duration in seconds
+frame_cache_mb = 512  # Memory budget for recently decoded frames (makes rewind/skip scrubbing instant)
+use_proxy = False  # Navigate and mark on a small all-intra proxy of the video (built once, next to the video)
+proxy_max_size = (960, 540)  # Largest proxy frame size
+find_runs = False  # Propose run intervals from the video's motion (pre-pass cached next to the video)
+run_intervals = []  # Proposed (first frame, last frame) run intervals, jumped between with ',' and '.'
 sections = ["Experiment_I", "Experiment_II", "Experiment_III"]  # Predefined sections
 section_index = 0  # Current section index
 section_name = sections[section_index]
@@ -24,11 +44,35 @@ run_number = 1
 is_paused = False
 is_replaying = False
 frame_rate_display = ""  # For displaying frame rate change
+status_display = ""  # For displaying tracking mode status
+tracking_mode = False  # Propagate each clicked point forward automatically
+awaiting_correction = False  # Tracking lost confidence; paused until a correction click
+min_tracking_confidence = 0.5  # Pause for a manual correction below this confidence
+current_frame = None  # Last frame taken from the background reader
+display_frame = None
+needs_redraw = False  # Re-render the current frame (zoom, pan or overlay changed while no new frame arrived)
+drag_origin = None  # Last mouse position of a right-button pan drag
+trail_frames = 0  # Also show the points of this many previous frames
+select_radius = 10  # Click distance in viewport pixels that selects an existing point
+selected_point = None  # Point selected for dragging or deleting (a record of `data`)
+dragging_point = False  # Left button held on the selected point
+show_next_frame = True  # Take one frame even while paused (e.g. after a seek)
+next_frame_due = 0.0  # Monotonic time at which the next frame should be shown
+full_cap = None  # Capture of the full-resolution video, when playing a proxy
+full_cap_position = None  # Index `full_cap` will decode next
+full_res_shown = False  # The frame on screen is the full-resolution one from 'u'; clicks mark it even though paused
 output_folder = "output_data"
 
 # Ensure output folder exists
 os.makedirs(output_folder, exist_ok=True)
 
+# Save any run left unfinished by a crash, then journal the new run's points as they are marked
+recovered_path = recover_journal(output_folder)
+if recovered_path:
+    print(f"Recovered unsaved data to {recovered_path}")
+journal = ClickJournal(output_folder)
+point_index = PointIndex()  # The points of `data` by frame, for drawing and click-to-edit
+
 # Function to update the section name based on index
 def update_section():
     global section_name, run_number
@@ -43,80 +87,315 @@ def update_v_flow():
     run_number = 1  # Reset run number for new v_flow
     print(f"Current v_flow level: {v_flow_name}")
 
-# Mouse callback function to record click coordinates and timestamp
+# Function to record a point on the current run; `source` is 'manual' for clicks and 'auto' for tracked points
+def record_point(frame, x, y, source='manual', confidence=1.0):
+    global data_version, needs_redraw
+    record = {
+        'section': section_name,
+        'v_flow': v_flow_name,
+        'run': f'Run_{run_number}',
+        'x': round(x, 1),
+        'y': round(y, 1),
+        'timestamp': frame.pts,  # Taken from the frame index
+        'frame': frame.index,
+        'source': source,
+        'confidence': round(confidence, 3)
+    }
+    data.append(record)
+    point_index.add(record)
+    journal.append(record)  # Written to disk right away so a crash does not lose the run
+    data_version += 1
+    needs_redraw = True
+
+# Frames whose points are shown: the current frame and the `trail_frames` before it
+def shown_frames():
+    return max(current_frame.index - trail_frames, 0), current_frame.index
+
+# Function to save the run's points to the journal again after one was moved or deleted
+def points_edited():
+    global data_version, needs_redraw
+    journal.rewrite(data)
+    data_version += 1
+    needs_redraw = True
+
+# Function to delete the selected point
+def delete_selected_point():
+    global data, selected_point, dragging_point
+    if selected_point is None:
+        return
+    point_index.remove(selected_point)
+    data[:] = [record for record in data if record is not selected_point]
+    selected_point = None
+    dragging_point = False
+    points_edited()
+
+# Mouse callback function to record click coordinates and timestamp, to select and drag existing points,
+# and to pan with a right-button drag
 def click_event(event, x, y, flags, param):
-    if event == cv2.EVENT_LBUTTONDOWN and not is_paused:
-        # Get current timestamp (in seconds)
-        timestamp = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+    global needs_redraw, drag_origin, is_paused, awaiting_correction, status_display, next_frame_due
+    global selected_point, dragging_point
+    # Points in the letterbox borders (zoomed out below 1) would lie outside the video: clicks there are
+    # ignored, and a dragged point stays put while the mouse is over them
+    on_video = viewport.contains(x, y)
+    if event == cv2.EVENT_LBUTTONDOWN and current_frame is not None and on_video:
+        # A click on a shown point selects it for dragging or deleting (Backspace) instead of marking a new one,
+        # except for a correction click, which always reseeds tracking
+        hit = None
+        if not awaiting_correction:
+            hit = point_index.nearest(*shown_frames(), *viewport.to_source(x, y), select_radius / viewport.scale)
+        if hit is not None or selected_point is not None:
+            selected_point = hit
+            dragging_point = hit is not None
+            needs_redraw = True
+        if hit is not None or (is_paused and not awaiting_correction and not full_res_shown):
+            return
+
+        # Map the click from viewport to source-video pixels so points do not depend on the zoom level
+        # (the viewport always maps source pixels, whether a proxy or a full-resolution frame is on screen)
+        source_x, source_y = viewport.to_source(x, y)
 
         # Record the point and timestamp
-        data.append({
-            'section': section_name,
-            'v_flow': v_flow_name,
-            'run': f'Run_{run_number}',
-            'x': x,
-            'y': y,
-            'timestamp': timestamp
-        })
-
-        # Display point info on the frame
-        cv2.circle(display_frame, (x, y), 5, (0, 255, 0), -1)
-        cv2.putText(display_frame, f'({x},{y}) @ {timestamp:.2f}s', (x + 5, y + 5),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
+        record_point(current_frame, source_x, source_y)
+
+        # In tracking mode every click (re)seeds propagation; a correction click also resumes playback
+        if tracking_mode:
+            image, image_scale = tracking_image(current_frame.image)
+            propagator.seed(current_frame.index, image, source_x * image_scale, source_y * image_scale)
+            status_display = "Tracking"
+            if awaiting_correction:
+                awaiting_correction = False
+                is_paused = False
+                next_frame_due = time.monotonic()
+    elif event == cv2.EVENT_MOUSEMOVE and dragging_point and flags & cv2.EVENT_FLAG_LBUTTON:
+        if on_video:
+            point_index.move(selected_point, *viewport.to_source(x, y))
+            needs_redraw = True
+    elif event == cv2.EVENT_LBUTTONUP and dragging_point:
+        dragging_point = False
+        points_edited()
+        # Moving the point of the frame on screen in tracking mode moves the tracked point: reseed from there
+        if tracking_mode and selected_point['frame'] == current_frame.index:
+            image, image_scale = tracking_image(current_frame.image)
+            propagator.seed(current_frame.index, image, selected_point['x'] * image_scale,
+                            selected_point['y'] * image_scale)
+            status_display = "Tracking"
+    elif event == cv2.EVENT_RBUTTONDOWN:
+        drag_origin = (x, y)
+    elif event == cv2.EVENT_MOUSEMOVE and drag_origin is not None and flags & cv2.EVENT_FLAG_RBUTTON:
+        viewport.pan(drag_origin[0] - x, drag_origin[1] - y)
+        drag_origin = (x, y)
+        needs_redraw = True
+    elif event == cv2.EVENT_RBUTTONUP:
+        drag_origin = None
 
 # Function to save the current section's data with a unique filename
 def save_data():
-    global data, section_name, v_flow_name, run_number
+    global data, data_version, section_name, v_flow_name, run_number, selected_point, dragging_point
+    propagator.stop()  # A new run needs a new seed
     if data:
         # Create a unique filename using section name, v_flow level, run number, and timestamp
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = os.path.join(output_folder, f'{section_name}_{v_flow_name}_Run_{run_number}_{timestamp}.csv')
-        df = pd.DataFrame(data)
-        df.to_csv(filename, index=False)
+        filename = os.path.join(output_folder, run_filename(section_name, v_flow_name, run_number))
+        journal.finalize(filename)  # The journal already holds the run as CSV; saving is a rename
         print(f"Data saved to {filename}")
         data.clear()  # Clear data for the next run
+        point_index.clear()
+        selected_point = None
+        dragging_point = False
+        data_version += 1
 
 # Slider callback to control the zoom level
 def update_scale(val):
-    global scale_factor
-    scale_factor = max(val / 10, 0.5)  # Scale between 0.5 and 3.0
+    set_zoom(val / 10)
+
+# Function to apply a zoom level to the viewport
+def set_zoom(value):
+    global scale_factor, needs_redraw
+    scale_factor = min(max(value, 0.5), 3.0)  # Scale between 0.5 and 3.0
+    viewport.set_zoom(scale_factor)
+    needs_redraw = True
+
+# Function to pan the viewport by a fraction of its size
+def pan_view(fx, fy):
+    global needs_redraw
+    viewport.pan(fx * viewport.width, fy * viewport.height)
+    needs_redraw = True
+
+# Draw the status text and the list of the latest points into the cached overlay layer
+def draw_overlay(image):
+    # Display the current frame rate
+    if frame_rate_display:
+        cv2.putText(image, frame_rate_display, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1)
+
+    # Display the tracking status
+    if status_display:
+        cv2.putText(image, status_display, (10, 78), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 1)
+
+    # Display the last 10 points and timestamps
+    y_offset = 90
+    for i, entry in enumerate(data[-10:]):
+        text = f"({entry['x']},{entry['y']}) @ {entry['timestamp']:.2f}s"
+        if entry.get('source') == 'auto':
+            text += f" auto {entry['confidence']:.2f}"
+        cv2.putText(image, text, (10, y_offset + (i * 20)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
+
+# Mark the points of the shown frames, looked up in the point index; trailing frames are dimmed
+def draw_markers(image):
+    for entry in point_index.in_frames(*shown_frames()):
+        center = viewport.to_view(entry['x'], entry['y'])
+        color = (0, 255, 0) if entry['frame'] == current_frame.index else (0, 110, 0)
+        cv2.circle(image, center, 5, color, -1)
+        if entry is selected_point:
+            cv2.circle(image, center, 9, (0, 255, 255), 2)
+
+# Render the current frame through the viewport with the time and the cached overlay on top
+def redraw_view():
+    global display_frame, needs_redraw
+    display_frame = viewport.render(current_frame.image)
+
+    # Display current video time on the frame
+    cv2.putText(display_frame, f'Time: {current_frame.pts:.2f}s', (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 1)
+
+    draw_markers(display_frame)
+    playback_stats.mark('render')
+
+    overlay.update((data_version, frame_rate_display, status_display, viewport.version), draw_overlay)
+    overlay.apply(display_frame)
+    playback_stats.draw_hud(display_frame)
+    playback_stats.mark('overlay')
+    needs_redraw = False
+
+# Image the tracker works on, and its pixels per source pixel: always the playback resolution, so a
+# point seeded on a full-resolution frame (see `show_full_resolution`) can be followed on the proxy
+def tracking_image(image):
+    if image.shape[1] != playback_size[0]:
+        image = cv2.resize(image, playback_size, interpolation=cv2.INTER_AREA)
+    return image, playback_size[0] / viewport.frame_width
+
+# Function to carry the tracked point onto a newly shown frame, pausing for a correction when confidence drops
+def propagate_point(frame):
+    global is_paused, awaiting_correction, status_display, needs_redraw
+    image, image_scale = tracking_image(frame.image)
+    result = propagator.step(frame.index, image)
+    if result is None:
+        if status_display == "Tracking":
+            status_display = "Tracking: click to seed"  # Playback jumped; propagation needs a new seed
+            needs_redraw = True
+        return
+    x, y, confidence = result
+    x, y = x / image_scale, y / image_scale  # Back to source pixels
+    if confidence >= min_tracking_confidence:
+        record_point(frame, x, y, source='auto', confidence=confidence)
+    else:
+        is_paused = True
+        awaiting_correction = True
+        status_display = f"Low tracking confidence ({confidence:.2f}): click to correct"
+        needs_redraw = True
+
+# Function to switch tracking mode on or off
+def toggle_tracking():
+    global tracking_mode, awaiting_correction, status_display, needs_redraw
+    tracking_mode = not tracking_mode
+    awaiting_correction = False
+    propagator.stop()
+    status_display = "Tracking: click to seed" if tracking_mode else ""
+    needs_redraw = True
+
+# Function to jump playback to a frame index, flushing frames decoded from the old position
+def seek_video(frame_index):
+    global show_next_frame, next_frame_due
+    reader.seek(frame_index)
+    playback_stats.break_pacing()
+    show_next_frame = True  # Show the new position even while paused
+    next_frame_due = time.monotonic()
+
+# Index of the frame currently on screen
+def current_index():
+    return current_frame.index if current_frame is not None else 0
+
+# Function to jump to the start of the next proposed run interval, saving the current run and moving on
+# to the next run number if points were marked, or (backwards) to the start of the previous interval,
+# i.e. the one before the interval being watched
+def jump_to_run_interval(forward=True):
+    global run_number
+    starts = [start for start, _ in run_intervals]
+    if forward:
+        position = bisect.bisect_right(starts, current_index())
+    else:
+        position = bisect.bisect_right(starts, current_index()) - 1
+        if position >= 0 and current_index() <= run_intervals[position][1]:
+            position -= 1  # Inside an interval: skip past its own start
+    if not 0 <= position < len(starts):
+        print("No more proposed runs in this direction")
+        return
+    if forward and data:
+        save_data()
+        run_number += 1
+        print('run_number: ', run_number)
+    start, end = run_intervals[position]
+    print(f"Proposed run {position + 1}/{len(run_intervals)}: "
+          f"{frame_index.pts_at(start):.2f}s - {frame_index.pts_at(end):.2f}s")
+    seek_video(start)
 
 # Function to rewind the video by a set number of seconds
 def rewind_video():
-    current_pos = cap.get(cv2.CAP_PROP_POS_MSEC)
-    new_pos = max(current_pos - rewind_seconds * 1000, 0)  # Rewind by `rewind_seconds`, min 0
-    cap.set(cv2.CAP_PROP_POS_MSEC, new_pos)
-
-# Function to skip forward in the video by a set number of seconds
-def skip_forward_video():
-    current_pos = cap.get(cv2.CAP_PROP_POS_MSEC)
-    video_duration = cap.get(cv2.CAP_PROP_FRAME_COUNT) / cap.get(cv2.CAP_PROP_FPS) * 1000
-    new_pos = min(current_pos + skip_forward_seconds * 1000, video_duration)
-    cap.set(cv2.CAP_PROP_POS_MSEC, new_pos)
-
-def skip_forward_video(val):
-    current_pos = cap.get(cv2.CAP_PROP_POS_MSEC)
-    video_duration = cap.get(cv2.CAP_PROP_FRAME_COUNT) / cap.get(cv2.CAP_PROP_FPS) * 1000
-    new_pos = min(current_pos + skip_forward_seconds * 1000 * val, video_duration)
-    cap.set(cv2.CAP_PROP_POS_MSEC, new_pos)
-
-# Function to replay marked points sequentially
-def replay_marked_points():
-    global is_replaying
+    seek_video(current_index() - int(rewind_seconds * reader.fps))  # Rewind by `rewind_seconds`, min 0
+
+# Function to skip forward in the video by a set number of seconds (negative `val` skips back)
+def skip_forward_video(val=1):
+    seek_video(current_index() + int(skip_forward_seconds * val * reader.fps))
+
+# Function to replay marked points frame by frame in timestamp order, drawing every point of a frame at once
+def replay_marked_points(entries=None):
+    global is_replaying, needs_redraw, next_frame_due
     is_replaying = True
-    for entry in data:
-        cap.set(cv2.CAP_PROP_POS_MSEC, entry['timestamp'] * 1000)  # Set to specific timestamp
-        ret, frame = cap.read()
-        if not ret:
-            break
-        display_frame = cv2.resize(frame, None, fx=scale_factor, fy=scale_factor, interpolation=cv2.INTER_LINEAR)
-        cv2.circle(display_frame, (entry['x'], entry['y']), 5, (0, 0, 255), -1)
-        cv2.putText(display_frame, f"Replay ({entry['x']},{entry['y']}) @ {entry['timestamp']:.2f}s",
+    entries = data if entries is None else entries
+    replay_cap = open_playback()  # Separate capture so the playback buffer is left untouched
+    plan = plan_replay(entries, frame_index)
+    for frame_number, frame, frame_entries in iter_replay_frames(replay_cap, playback_index, plan):
+        display_frame = viewport.render(frame)
+        for entry in frame_entries:
+            cv2.circle(display_frame, viewport.to_view(entry['x'], entry['y']), 5, (0, 0, 255), -1)
+        cv2.putText(display_frame, f"Replay {len(frame_entries)} point(s) @ {frame_index.pts_at(frame_number):.2f}s",
                     (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 1)
         cv2.imshow("Video", display_frame)
         if cv2.waitKey(frame_delay) & 0xFF == ord('q'):
             break
+    replay_cap.release()
+    playback_stats.break_pacing()
+    next_frame_due = time.monotonic()  # Otherwise playback counts the replay as lateness and drops frames
     is_replaying = False
+    needs_redraw = True
+
+# Function to pick a saved run CSV from the output folder and replay it
+def replay_saved_run():
+    csv_path = filedialog.askopenfilename(
+        title="Select a run CSV to replay",
+        filetypes=[("CSV files", "*.csv")],
+        initialdir=output_folder
+    )
+    if csv_path:
+        replay_marked_points(load_replay_entries(csv_path))
+
+# Function to replace the frame on screen with the same frame decoded from the full-resolution video
+# (when playing a proxy), pausing so points can be placed precisely
+def show_full_resolution():
+    global full_cap, full_cap_position, current_frame, is_paused, needs_redraw, full_res_shown
+    if not use_proxy or current_frame is None or current_frame.image.shape[1] == viewport.frame_width:
+        return
+    if full_cap is None:
+        full_cap = cv2.VideoCapture(video_path)
+    seek_exact(full_cap, frame_index, current_frame.index, full_cap_position)
+    ret, image = full_cap.read()
+    full_cap_position = current_frame.index + 1 if ret else None
+    if ret:
+        current_frame = current_frame._replace(image=image)
+        is_paused = True
+        full_res_shown = True
+        needs_redraw = True
+
+# Open a capture of the video that is played: the proxy, or the video itself
+def open_playback():
+    return open_proxy(playback_path) if use_proxy else cv2.VideoCapture(video_path)
 
 # Open video file
 cap = cv2.VideoCapture(video_path)
@@ -125,6 +404,38 @@ if not cap.isOpened():
     print("Error: Could not open video.")
     exit()
 
+# Load (or build once and save) the frame index so seeks and timestamps are frame-exact
+frame_index = load_or_build_index(video_path)
+source_size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+
+# With a proxy, play the proxy instead; its frames correspond one to one with the video's
+playback_path, playback_index = video_path, frame_index
+if use_proxy:
+    playback_path, source_size = load_or_build_proxy(video_path, proxy_max_size)
+    playback_index = proxy_frame_index(frame_index)
+    cap.release()
+    cap = open_playback()
+
+# Propose where the runs are, so idle footage between them can be skipped. The proposals are cached;
+# run `python run_segmentation.py <video>` beforehand to do the pre-pass on all cores.
+if find_runs:
+    run_intervals = load_or_segment(video_path, frame_index, workers=1)
+playback_size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+
+# Decode frames on a background thread and pace playback against the video's native frame rate
+reader = FrameReader(cap, frame_index=playback_index, cache=FrameCache(frame_cache_mb * 1024 * 1024)).start()
+frame_delay = max(int(round(1000 / reader.fps)), 10)
+
+# Per-frame timings, dropped/late frame counts and the stats HUD (toggled with 'h'; free while off)
+playback_stats = PlaybackStats(reader.fps)
+
+# Propagates the seeded point from frame to frame in tracking mode
+propagator = PointPropagator(min_confidence=min_tracking_confidence)
+
+# Fixed-size viewport for zoom/pan and the cached text/marker layer drawn over it
+viewport = Viewport(source_size[0], source_size[1], viewport_size)  # Always in source-video pixels
+overlay = OverlayLayer(viewport.width, viewport.height)
+
 # Create a window and set the mouse callback
 cv2.namedWindow("Video")
 cv2.setMouseCallback("Video", click_event)
@@ -133,54 +444,93 @@ cv2.setMouseCallback("Video", click_event)
 cv2.createTrackbar("Zoom", "Video", int(scale_factor * 10), 30, update_scale)
 
 # Main loop to handle video playback and user input
+next_frame_due = time.monotonic()
 while True:
-    if not is_paused and not is_replaying:
-        ret, frame = cap.read()
-        if not ret:
+    playback_stats.begin_pass()
+    now = time.monotonic()
+    if (show_next_frame or not is_paused) and not is_replaying and now >= next_frame_due:
+        frame_interval = frame_delay / 1000
+
+        # If the display fell behind by whole frames, drop them rather than slowing playback down
+        # (except while tracking, which needs every frame)
+        late_frames = int((now - next_frame_due) / frame_interval)
+        dropped = reader.drop(late_frames) if late_frames and not show_next_frame and not tracking_mode else 0
+
+        frame = reader.get(timeout=frame_interval)
+        if frame is None and reader.eof:
             # End of video: prompt user to save any remaining data
             if messagebox.askyesno("Video Ended", "The video has ended. Would you like to save the current data?"):
                 save_data()
             break  # Exit loop if video ends
-
-        # Resize the frame according to the scale factor
-        display_frame = cv2.resize(frame, None, fx=scale_factor, fy=scale_factor, interpolation=cv2.INTER_LINEAR)
-
-        # Display current video time on the frame
-        current_time = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000  # Convert milliseconds to seconds
-        cv2.putText(display_frame, f'Time: {current_time:.2f}s', (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 1)
-
-        # Display the last 10 points and timestamps
-        y_offset = 90
-        for i, entry in enumerate(data[-10:]):
-            text = f"({entry['x']},{entry['y']}) @ {entry['timestamp']:.2f}s"
-            cv2.putText(display_frame, text, (10, y_offset + (i * 20)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
-
-        # Display the current frame rate
-        if frame_rate_display:
-            cv2.putText(display_frame, frame_rate_display, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1)
+    else:
+        frame = None
+    playback_stats.mark('read')
+
+    if frame is not None:
+        playback_stats.frame_shown(frame.index, 0.0 if show_next_frame else now - next_frame_due, dropped, frame_interval)
+        current_frame = frame
+        full_res_shown = False
+        show_next_frame = False
+        next_frame_due += frame_interval * (dropped + 1)
+        if next_frame_due < now:
+            next_frame_due = now + frame_interval  # Decoder could not keep up; resync the clock
+        if tracking_mode and propagator.active:
+            propagate_point(frame)
+        playback_stats.mark('track')
+
+    # Render a new frame, or the current one again if zoom, pan or the overlay changed
+    if current_frame is not None and (frame is not None or needs_redraw):
+        redraw_view()
 
     # Show the frame with updated information
-    cv2.imshow("Video", display_frame)
+    if display_frame is not None:
+        cv2.imshow("Video", display_frame)
+    playback_stats.mark('imshow')
 
-    # Keyboard controls
-    key = cv2.waitKey(frame_delay) & 0xFF
+    # Keyboard controls; while playing, only wait until the next frame is due
+    if is_paused or is_replaying:
+        wait_ms = frame_delay
+    else:
+        wait_ms = max(int((next_frame_due - time.monotonic()) * 1000), 1)
+    key = cv2.waitKey(wait_ms) & 0xFF
+    playback_stats.mark('wait')
+    playback_stats.end_pass()
 
     if key == ord('q'):  # Quit
         break
     elif key == ord('+'):  # Increase zoom (alternative to slider)
-        scale_factor = min(scale_factor + 0.1, 3.0)
-        cv2.setTrackbarPos("Zoom", "Video", int(scale_factor * 10))
+        set_zoom(scale_factor + 0.1)
+        cv2.setTrackbarPos("Zoom", "Video", int(round(scale_factor * 10)))
     elif key == ord('-'):  # Decrease zoom (alternative to slider)
-        scale_factor = max(scale_factor - 0.1, 0.5)
-        cv2.setTrackbarPos("Zoom", "Video", int(scale_factor * 10))
+        set_zoom(scale_factor - 0.1)
+        cv2.setTrackbarPos("Zoom", "Video", int(round(scale_factor * 10)))
+    elif key == ord('i'):  # Pan up
+        pan_view(0, -pan_step)
+    elif key == ord('k'):  # Pan down
+        pan_view(0, pan_step)
+    elif key == ord('j'):  # Pan left
+        pan_view(-pan_step, 0)
+    elif key == ord('l'):  # Pan right
+        pan_view(pan_step, 0)
+    elif key == ord('o'):  # Reset zoom and pan
+        viewport.reset()
+        set_zoom(1.0)
+        cv2.setTrackbarPos("Zoom", "Video", 10)
     elif key == ord('['):  # Slow down
         frame_delay = min(frame_delay + 10, 200)
         frame_rate_display = f"Frame Delay: {frame_delay} ms"
+        needs_redraw = True
     elif key == ord(']'):  # Speed up
         frame_delay = max(frame_delay - 10, 10)
         frame_rate_display = f"Frame Delay: {frame_delay} ms"
+        needs_redraw = True
     elif key == ord('p'):  # Play/pause toggle
         is_paused = not is_paused
+        next_frame_due = time.monotonic()  # Resume without trying to catch up on the paused time
+        playback_stats.break_pacing()
+    elif key == ord('h'):  # Toggle playback timing stats (HUD and timing log)
+        print(f"Playback stats {'on' if playback_stats.toggle() else 'off'}")
+        needs_redraw = True
     elif key == ord('r'):  # Rewind the video
         rewind_video()
     elif key == ord('e'):
@@ -189,10 +539,22 @@ while True:
         skip_forward_video(1)
     elif key == ord('g'):
         skip_forward_video(60)
+    elif key == ord('t'):  # Toggle tracker-assisted marking
+        toggle_tracking()
     elif key == ord('v'):  # Replay marked points
         replay_marked_points()
+    elif key == ord('V'):  # Replay a saved run CSV
+        replay_saved_run()
+    elif key == 8:  # Backspace: delete the selected point
+        delete_selected_point()
+    elif key == ord('u'):  # Show the current frame at full resolution (when playing a proxy)
+        show_full_resolution()
 
     # Group for run_number
+    elif key == ord('.'):  # Jump to the next proposed run (saving the current one)
+        jump_to_run_interval()
+    elif key == ord(','):  # Jump back to the previous proposed run
+        jump_to_run_interval(forward=False)
     elif key == ord('n'):  # New run within the current section
         save_data()  # Save current data
         run_number += 1  # Increment run number
@@ -240,6 +602,14 @@ while True:
 # Final save of any remaining data
 save_data()
 
-# Release video capture and close windows
+# Write the timing log of the session, if stats were switched on
+timing_path = playback_stats.save(output_folder)
+if timing_path:
+    print(f"Playback: {playback_stats.summary()}; timing log saved to {timing_path}")
+
+# Stop the decode thread, release video capture and close windows
+reader.stop()
 cap.release()
+if full_cap is not None:
+    full_cap.release()
 cv2.destroyAllWindows()
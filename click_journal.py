@@ -0,0 +1,115 @@
+import csv
+import os
+import time
+from datetime import datetime
+from typing import List, Optional
+
+from run_files import run_filename, run_number_of
+
+# Columns of a point record, in the order they are written
+JOURNAL_FIELDS = ['section', 'v_flow', 'run', 'x', 'y', 'timestamp', 'frame', 'source', 'confidence']
+
+# Name of the journal of the run being marked, kept in the output folder
+JOURNAL_NAME = 'current_run.journal'
+
+
+# Append-only journal of the current run's points. Every point is written as one line-buffered CSV
+# record the moment it is marked and fsynced periodically, so a crash loses at most the last few
+# points. The journal already has the layout of a per-run CSV, so saving a run is a rename.
+class ClickJournal:
+    def __init__(self, folder: str, fsync_every: int = 20, fsync_seconds: float = 1.0):
+        self.path = os.path.join(folder, JOURNAL_NAME)
+        self.fsync_every = fsync_every
+        self.fsync_seconds = fsync_seconds
+        self.count = 0
+        self._file = None
+        self._writer = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _open(self):
+        self._file = open(self.path, 'w', newline='', buffering=1)
+        self._writer = csv.DictWriter(self._file, fieldnames=JOURNAL_FIELDS, lineterminator='\n')
+        self._writer.writeheader()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _close(self):
+        if self._file is not None:
+            self._sync()
+            self._file.close()
+        self._file = None
+        self._writer = None
+        self.count = 0
+
+    # Write one point record
+    def append(self, record: dict):
+        if self._file is None:
+            self._open()
+        self._writer.writerow(record)
+        self.count += 1
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_seconds:
+            self._sync()
+
+    # Replace the journal contents (after points were edited or deleted), atomically
+    def rewrite(self, records: List[dict]):
+        self._close()
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=JOURNAL_FIELDS, lineterminator='\n')
+            writer.writeheader()
+            writer.writerows(records)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        self._file = open(self.path, 'a', newline='', buffering=1)
+        self._writer = csv.DictWriter(self._file, fieldnames=JOURNAL_FIELDS, lineterminator='\n')
+        self.count = len(records)
+
+    # Turn the journal into the run CSV at `path`; returns the path, or None if nothing was journaled
+    def finalize(self, path: str) -> Optional[str]:
+        if self._file is None:
+            return None
+        has_records = self.count > 0
+        self._close()
+        if not has_records:
+            os.remove(self.path)
+            return None
+        os.replace(self.path, path)
+        return path
+
+    def close(self):
+        self._close()
+
+
+# Save a journal left behind by a crash as a run CSV (named after the run of its first point and the
+# time it was last written); returns the saved path, or None if there was nothing to recover
+def recover_journal(folder: str) -> Optional[str]:
+    path = os.path.join(folder, JOURNAL_NAME)
+    if not os.path.exists(path):
+        return None
+
+    with open(path, 'rb') as f:
+        content = f.read()
+    # Drop a record that was only partly written when the process died
+    if not content.endswith(b'\n'):
+        content = content[:content.rfind(b'\n') + 1]
+    lines = content.splitlines()
+    if len(lines) < 2:
+        os.remove(path)
+        return None
+
+    first = next(csv.DictReader([lines[0].decode(), lines[1].decode()]))
+    v_flow = int(first['v_flow']) if first['v_flow'].lstrip('-').isdigit() else first['v_flow']
+    recorded_at = datetime.fromtimestamp(os.path.getmtime(path))
+    recovered_path = os.path.join(folder, run_filename(first['section'], v_flow,
+                                                       run_number_of(first['run']), recorded_at))
+    with open(path, 'wb') as f:
+        f.write(content)
+    os.replace(path, recovered_path)
+    return recovered_path
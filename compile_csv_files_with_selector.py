@@ -1,11 +1,288 @@
+import argparse
+import glob
+import hashlib
+import io
+import json
 import os
 import pandas as pd
-from datetime import datetime
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
 import tkinter as tk
 from tkinter import filedialog
 
-# Date format in the CSV filenames (matching the timestamp format in `Point Marking Program`)
-DATE_FORMAT = "%Y%m%d_%H%M%S"
+# Date format and parsing of the CSV filenames (shared with the `Point Marking Program`)
+from run_files import DATE_FORMAT, parse_run_filename
+from storage import _clear, append_parquet, manifest_path, replace_compiled, storage_format, tail_sha1
+
+# Columns added to every compiled row to keep track of where it came from
+ORIGIN_COLUMNS = ['source_file', 'recorded_at']
+
+# Bump when the layout of the incremental-compile manifest changes
+MANIFEST_VERSION = 3
+
+
+# Expand directories and glob patterns into the list of CSV files to compile
+def find_run_files(sources: List[str]) -> List[str]:
+    file_paths = []
+    for source in sources:
+        if os.path.isdir(source):
+            file_paths.extend(sorted(glob.glob(os.path.join(source, '*.csv'))))
+        else:
+            file_paths.extend(sorted(glob.glob(source)) if glob.has_magic(source) else [source])
+    return file_paths
+
+
+# Parse section/v_flow/run/timestamp from every filename once, up front
+def parse_run_files(file_paths: List[str]) -> List[Tuple[str, dict]]:
+    parsed = []
+    for file_path in file_paths:
+        try:
+            # Assuming filename format: <section>_<v_flow>_Run_<run_number>_<timestamp>.csv
+            parsed.append((file_path, parse_run_filename(file_path)))
+        except ValueError as e:
+            print(f"Skipping file {os.path.basename(file_path)} due to error: {e}")
+    return parsed
+
+
+# Column order of the compiled file: every header seen, in first-seen order, then the origin columns.
+# `columns` are the data columns of an existing compiled file to extend.
+def compiled_columns(file_paths: List[str], columns: List[str] = None) -> List[str]:
+    columns = [column for column in columns or [] if column not in ORIGIN_COLUMNS]
+    for file_path in file_paths:
+        try:
+            with open(file_path, newline='', encoding='utf-8-sig') as f:
+                header = f.readline().strip()
+        except OSError:
+            continue  # Reported when the file itself is read
+        for column in header.split(','):
+            if column and column not in columns:
+                columns.append(column)
+    return columns + ORIGIN_COLUMNS
+
+
+# Read one run CSV and tag its rows with their origin (`source_file`, the filename unless given).
+# Returns the rows and the SHA-1 of the file (hashed from the same read), or None (and reports why)
+# if it cannot be read.
+def read_run_file(file_path: str, info: dict,
+                  source_file: Optional[str] = None) -> Optional[Tuple[pd.DataFrame, str]]:
+    try:
+        with open(file_path, 'rb') as f:
+            content = f.read()
+        df = pd.read_csv(io.BytesIO(content))
+    except Exception as e:
+        print(f"Skipping file {os.path.basename(file_path)} due to error: {e}")
+        return None
+    df['source_file'] = source_file or os.path.basename(file_path)
+    df['recorded_at'] = info['recorded_at']
+    return df, hashlib.sha1(content).hexdigest()
+
+
+def _file_sha1(file_path: str) -> str:
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Compile run CSVs without any dialog. Files are read `batch_size` at a time by a thread pool and each
+# batch is appended to the output as soon as it is read, so memory stays bounded however many files there are.
+# `output_format` 'parquet' writes a Parquet dataset partitioned by section/v_flow instead of a CSV.
+def compile_csv_files(file_paths: List[str], output_folder: str = 'compiled_data', workers: int = None,
+                      batch_size: int = 256, output_format: str = 'csv') -> Optional[str]:
+    parsed = parse_run_files(file_paths)
+    if not parsed:
+        print("No valid files were selected.")
+        return None
+
+    # Ensure output folder exists
+    os.makedirs(output_folder, exist_ok=True)
+
+    # The output is named after the files that could actually be read, so it is written to a temporary path first
+    columns = compiled_columns([file_path for file_path, _ in parsed])
+    temp_path = os.path.join(output_folder, f'compiled_data.{output_format}.tmp')
+    _clear(temp_path)
+    rows = 0
+    read_dates = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        if output_format == 'csv':
+            pd.DataFrame(columns=columns).to_csv(temp_path, index=False)
+        for part, start in enumerate(range(0, len(parsed), batch_size)):
+            batch = parsed[start:start + batch_size]
+            frames = []
+            for (_, info), result in zip(batch, pool.map(lambda item: read_run_file(*item), batch)):
+                if result is not None:
+                    frames.append(result[0])
+                    read_dates.append(info['recorded_at'])
+            if frames:
+                batch_df = pd.concat(frames, ignore_index=True).reindex(columns=columns)
+                if output_format == 'csv':
+                    batch_df.to_csv(temp_path, mode='a', header=False, index=False)
+                else:
+                    append_parquet(batch_df, temp_path, part)
+                rows += len(batch_df)
+
+    if not read_dates:
+        _clear(temp_path)
+        print("No valid files were selected.")
+        return None
+    if not os.path.exists(temp_path):
+        # A Parquet dataset only comes into being with its first rows
+        print("No valid files were selected: the files hold no rows.")
+        return None
+
+    # Create the output filename based on the earliest date
+    first_date_in_range = min(read_dates)
+    output_filename = f'compiled_data_{first_date_in_range.strftime(DATE_FORMAT)}.{output_format}'
+    output_path = os.path.join(output_folder, output_filename)
+    replace_compiled(temp_path, output_path)
+
+    print(f"Compiled data saved to {output_path} ({rows} rows from {len(read_dates)} files)")
+    return output_path
+
+
+# Load the manifest of `output_path`, or None if the compiled file has to be rebuilt from scratch
+def load_manifest(output_path: str) -> Optional[dict]:
+    path = manifest_path(output_path)
+    if not (os.path.exists(path) and os.path.exists(output_path)):
+        return None
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable manifest {path}: {e}")
+        return None
+    if manifest.get('version') != MANIFEST_VERSION:
+        return None
+
+    # The file must still start with exactly what the manifest describes. Bytes after that come from an
+    # interrupted compile and are dropped; anything else (e.g. the file was transformed or edited) means
+    # the manifest no longer applies and the file is rebuilt.
+    size = os.path.getsize(output_path)
+    if size < manifest['output_size']:
+        return None
+    if os.path.getmtime(output_path) != manifest['output_mtime'] or size > manifest['output_size']:
+        if tail_sha1(output_path, manifest['output_size']) != manifest['output_tail_sha1']:
+            print(f"{output_path} was changed outside the incremental compile; rebuilding it")
+            return None
+    if size > manifest['output_size']:
+        os.truncate(output_path, manifest['output_size'])
+    return manifest
+
+
+def _save_manifest(output_path: str, columns: List[str], files: Dict[str, dict]):
+    path = manifest_path(output_path)
+    with open(f'{path}.tmp', 'w') as f:
+        size = os.path.getsize(output_path)
+        json.dump({'version': MANIFEST_VERSION, 'columns': columns, 'output_size': size,
+                   'output_mtime': os.path.getmtime(output_path), 'output_tail_sha1': tail_sha1(output_path, size),
+                   'files': files}, f, indent=1)
+    os.replace(f'{path}.tmp', path)
+
+
+# Runs saved more than once: groups of files with the same section/v_flow/run under different timestamps
+# (oldest first), and groups of files with identical content that are not already in one run group
+def find_duplicate_runs(files: Dict[str, dict]) -> Tuple[List[List[str]], List[List[str]]]:
+    by_run = defaultdict(list)
+    by_content = defaultdict(list)
+    for key, entry in files.items():
+        by_run[(entry['section'], str(entry['v_flow']), entry['run'])].append(key)
+        if entry['sha1']:  # Unknown until a new file has been read
+            by_content[entry['sha1']].append(key)
+    run_groups = [sorted(keys, key=lambda key: files[key]['recorded_at'])
+                  for keys in by_run.values() if len(keys) > 1]
+    grouped = {key for group in run_groups for key in group}
+    content_groups = [sorted(keys) for keys in by_content.values() if len(keys) > 1 and not grouped.issuperset(keys)]
+    return run_groups, content_groups
+
+
+# Compile incrementally into `output_name`, keeping a manifest (path, size, mtime, SHA-1, row count) next to it.
+# Files already compiled and unchanged are skipped after a stat; new files are appended; rows of deleted or
+# changed files are dropped. Files are identified by their path relative to the output folder (also stored
+# as `source_file`), so runs with the same filename in different folders are kept apart.
+# With `keep_latest_duplicates`, only the latest save of a run saved more than once is kept.
+def compile_incremental(file_paths: List[str], output_folder: str = 'compiled_data',
+                        output_name: str = 'compiled_data.csv', workers: int = None, batch_size: int = 256,
+                        keep_latest_duplicates: bool = False) -> Optional[str]:
+    if storage_format(output_name) != 'csv':
+        raise ValueError("Incremental compiles are appended as CSV; convert the result with storage.py")
+    os.makedirs(output_folder, exist_ok=True)
+    output_path = os.path.join(output_folder, output_name)
+    manifest = load_manifest(output_path)
+    compiled = manifest['files'] if manifest else {}
+
+    # Sort every current file into unchanged (same size and mtime, or same content) and to-add
+    files = {}
+    to_add = []
+    for file_path, info in parse_run_files(file_paths):
+        key = os.path.relpath(file_path, output_folder)
+        stat = os.stat(file_path)
+        entry = compiled.get(key)
+        if entry and entry['size'] == stat.st_size and (entry['mtime'] == stat.st_mtime or
+                                                        entry['sha1'] == _file_sha1(file_path)):
+            files[key] = dict(entry, mtime=stat.st_mtime)
+        else:
+            to_add.append((file_path, info))
+            files[key] = {'source_file': key, 'size': stat.st_size, 'mtime': stat.st_mtime,
+                          'sha1': entry['sha1'] if entry else None, 'rows': 0, 'section': info['section'],
+                          'v_flow': info['v_flow'], 'run': info['run'],
+                          'recorded_at': info['recorded_at'].strftime(DATE_FORMAT)}
+
+    # Report duplicated runs and, if asked, leave out all but the latest save of each run. Identical files
+    # that are not saves of the same run are only reported, since neither of them is the later save.
+    run_groups, content_groups = find_duplicate_runs(files)
+    for group in run_groups:
+        print(f"Duplicate run: {', '.join(group)}")
+        if keep_latest_duplicates:
+            for key in group[:-1]:
+                del files[key]
+    for group in content_groups:
+        print(f"Identical files: {', '.join(group)}")
+    to_add = [(file_path, info) for file_path, info in to_add if os.path.relpath(file_path, output_folder) in files]
+    adding = {os.path.relpath(file_path, output_folder) for file_path, _ in to_add}
+
+    # Deleted, changed and dropped duplicate files have rows in the compiled file that must go
+    removed = {key for key in compiled if key not in files or key in adding}
+    old_columns = manifest['columns'] if manifest else []
+    columns = compiled_columns([file_path for file_path, _ in to_add], old_columns)
+    if manifest and not to_add and not removed:
+        _save_manifest(output_path, columns, files)  # Refresh touched-but-unchanged mtimes
+        print(f"{output_path} is up to date ({len(files)} files)")
+        return output_path
+
+    # Appending is enough unless rows have to be dropped or the header gained columns
+    rewrite = manifest is None or bool(removed) or columns != old_columns
+    target = f'{output_path}.tmp' if rewrite else output_path
+    if rewrite:
+        pd.DataFrame(columns=columns).to_csv(target, index=False)
+        if manifest:
+            for chunk in pd.read_csv(output_path, chunksize=500_000):
+                chunk = chunk[~chunk['source_file'].isin(removed)].reindex(columns=columns)
+                chunk.to_csv(target, mode='a', header=False, index=False)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, len(to_add), batch_size):
+            batch = to_add[start:start + batch_size]
+            frames = []
+            items = [(file_path, info, os.path.relpath(file_path, output_folder)) for file_path, info in batch]
+            for (_, _, key), result in zip(items, pool.map(lambda item: read_run_file(*item), items)):
+                if result is None:
+                    del files[key]
+                    continue
+                df, sha1 = result
+                files[key].update(sha1=sha1, rows=len(df))
+                frames.append(df)
+            if frames:
+                pd.concat(frames, ignore_index=True).reindex(columns=columns).to_csv(
+                    target, mode='a', header=False, index=False)
+
+    if rewrite:
+        os.replace(target, output_path)
+    _save_manifest(output_path, columns, files)
+    print(f"Compiled data saved to {output_path}: {len(to_add)} files added, {len(removed)} removed, "
+          f"{sum(entry['rows'] for entry in files.values())} rows in total")
+    return output_path
 
 
 def compile_csv_files_with_selector(output_folder: str = 'compiled_data'):
@@ -20,48 +297,34 @@ def compile_csv_files_with_selector(output_folder: str = 'compiled_data'):
         initialdir=os.getcwd()
     )
 
-    # Ensure output folder exists
-    os.makedirs(output_folder, exist_ok=True)
+    return compile_csv_files(list(file_paths), output_folder)
 
-    # List to store dataframes from selected files
-    compiled_data = []
-    first_date_in_range = None  # To determine output filename based on earliest date
 
-    # Process each selected file
-    for file_path in file_paths:
-        filename = os.path.basename(file_path)
-        try:
-            # Extract the date and time part from the filename
-            # Assuming filename format: <section>_<v_flow>_Run_<run_number>_<timestamp>.csv
-            parts = filename.split('_')
-            timestamp_str = f"{parts[-2]}_{parts[-1].replace('.csv', '')}"  # Combine date and time
-
-            # Parse the combined timestamp
-            file_datetime = datetime.strptime(timestamp_str, DATE_FORMAT)
-
-            # Read CSV and append to compiled data list
-            df = pd.read_csv(file_path)
-            compiled_data.append(df)
-
-            # Track the earliest date for naming the output file
-            if first_date_in_range is None or file_datetime < first_date_in_range:
-                first_date_in_range = file_datetime
-        except Exception as e:
-            print(f"Skipping file {filename} due to error: {e}")
-
-    # Concatenate all selected dataframes
-    if compiled_data:
-        compiled_df = pd.concat(compiled_data, ignore_index=True)
-        # Create the output filename based on the earliest date
-        output_filename = f'compiled_data_{first_date_in_range.strftime(DATE_FORMAT)}.csv'
-        output_path = os.path.join(output_folder, output_filename)
-
-        # Save the concatenated dataframe to the output file
-        compiled_df.to_csv(output_path, index=False)
-        print(f"Compiled data saved to {output_path}")
+def main():
+    parser = argparse.ArgumentParser(description="Combine per-run CSV files into one compiled CSV. "
+                                                 "Without sources, a file selection dialog is opened.")
+    parser.add_argument('sources', nargs='*', help="Directories, glob patterns or CSV files to compile")
+    parser.add_argument('--output-folder', default='compiled_data')
+    parser.add_argument('--workers', type=int, default=None, help="Reader threads (default: Python's default)")
+    parser.add_argument('--batch-size', type=int, default=256, help="Files read and written per batch")
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv',
+                        help="Output format; parquet is partitioned by section/v_flow (needs pyarrow)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Only process new or changed files, tracked in a manifest next to the output")
+    parser.add_argument('--output-name', default='compiled_data.csv', help="Output filename in incremental mode")
+    parser.add_argument('--keep-latest-duplicates', action='store_true',
+                        help="In incremental mode, keep only the latest save of a run saved more than once")
+    args = parser.parse_args()
+
+    if args.sources and args.incremental:
+        compile_incremental(find_run_files(args.sources), args.output_folder, args.output_name,
+                            args.workers, args.batch_size, args.keep_latest_duplicates)
+    elif args.sources:
+        compile_csv_files(find_run_files(args.sources), args.output_folder, args.workers, args.batch_size, args.format)
     else:
-        print("No valid files were selected.")
+        compile_csv_files_with_selector(args.output_folder)
 
 
 # Example usage
-compile_csv_files_with_selector()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+from typing import Tuple
+
+import numpy as np
+
+from trajectory_index import TrajectoryIndex
+
+# Most vectorised refinement passes of `lttb`; they usually settle well before this. Buckets still
+# unsettled after this many passes are finished with the sequential algorithm.
+MAX_LTTB_PASSES = 32
+
+# Fewest points a run is decimated to, so short runs in a crowded subplot keep their shape
+MIN_RUN_POINTS = 100
+
+
+# Largest-Triangle-Three-Buckets downsampling of a trajectory to `n_out` points; returns the indices of the
+# points kept (always including the first and last). The interior points are split into equal buckets
+# along the trajectory and from each bucket the point forming the largest triangle with its neighbours
+# in the x-y plane is kept, which preserves turns and extremes. Every bucket is evaluated at once: the
+# first pass uses the previous bucket's centroid as the left anchor, and each further pass the point the
+# previous pass chose there, until the choice stops changing. Later passes only revisit the buckets whose
+# left anchor moved. A choice can take one pass per bucket to propagate (e.g. on a zigzag), so after
+# `MAX_LTTB_PASSES` the remaining buckets are done sequentially; the result is always that of sequential LTTB.
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # Bucket b holds the interior points edges[b] .. edges[b + 1] - 1, padded to a rectangular matrix
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    sizes = np.diff(edges)
+    columns = np.arange(sizes.max())
+    valid = columns < sizes[:, None]
+    idx = np.minimum(edges[:-1, None] + columns, n - 2)
+    px, py = x[idx], y[idx]
+
+    # Centroid of each bucket; the right anchor of a bucket is the next bucket's centroid (or the last point)
+    cx = np.where(valid, px, 0).sum(axis=1) / sizes
+    cy = np.where(valid, py, 0).sum(axis=1) / sizes
+    nx = np.append(cx[1:], x[-1])[:, None]
+    ny = np.append(cy[1:], y[-1])[:, None]
+
+    ax = np.insert(cx[:-1], 0, x[0])[:, None]
+    ay = np.insert(cy[:-1], 0, y[0])[:, None]
+    chosen = np.zeros(len(sizes), dtype=np.int64)
+    rows = np.arange(len(sizes))
+    for _ in range(MAX_LTTB_PASSES):
+        area = np.abs((ax[rows] - nx[rows]) * (py[rows] - ay[rows]) - (ax[rows] - px[rows]) * (ny[rows] - ay[rows]))
+        picked = idx[rows, np.where(valid[rows], area, -1).argmax(axis=1)]
+        moved = rows[picked != chosen[rows]]
+        chosen[rows] = picked
+        # Buckets right of a moved choice get a new left anchor
+        rows = moved[moved < len(sizes) - 1] + 1
+        if not len(rows):
+            break
+        ax[rows, 0] = x[chosen[rows - 1]]
+        ay[rows, 0] = y[chosen[rows - 1]]
+    else:
+        # Not settled: every bucket left of the first unsettled one is final, finish the rest in order
+        for b in range(rows.min(), len(sizes)):
+            anchor = chosen[b - 1]
+            area = np.abs((x[anchor] - nx[b]) * (py[b] - y[anchor]) - (x[anchor] - px[b]) * (ny[b] - y[anchor]))
+            chosen[b] = idx[b, np.where(valid[b], area, -1).argmax()]
+
+    return np.concatenate(([0], chosen, [n - 1]))
+
+
+# Round a point budget up to a power of two, so small changes in subplot size reuse cached results
+def _budget_bucket(budget: int) -> int:
+    return 1 << max(int(budget) - 1, 1).bit_length()
+
+
+# x and y of one run decimated to about `budget` points. The result is cached per run and budget
+# in the index, so redrawing or exporting more figures from the same index does not recompute it.
+def decimated_xy(index: TrajectoryIndex, key: Tuple, budget: int) -> Tuple[np.ndarray, np.ndarray]:
+    x, y = index.xy(key)
+    budget = _budget_bucket(max(budget, MIN_RUN_POINTS))
+    if len(x) <= budget:
+        return x, y
+    cache_key = ('lttb', key, budget)
+    if cache_key not in index.cache:
+        keep = lttb(x, y, budget)
+        index.cache[cache_key] = (x[keep], y[keep])
+    return index.cache[cache_key]
+
+
+# Point budget of one subplot: `points_per_pixel` points for every pixel of its width on the figure
+def axes_point_budget(ax, points_per_pixel: float) -> int:
+    return int(ax.get_window_extent().width * points_per_pixel)
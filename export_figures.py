@@ -0,0 +1,86 @@
+import argparse
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Optional, Sequence
+
+import matplotlib
+matplotlib.use('Agg')  # Headless: no display needed, e.g. on a render box
+
+from graph_multiple_runs_grid_with_selection import build_trajectory_grid, load_data, load_selection_file
+from kinematics import load_or_compute_kinematics
+from trajectory_index import TrajectoryIndex
+
+# Per-process state set up by `_init_worker`
+_index = None
+_summary = None
+_color_by = None
+_run_query = None
+
+
+# Load the compiled data and index its runs (and load the run summary, if needed) once per worker process
+def _init_worker(data_filepath: str, color_by: Optional[str], run_query: Optional[str]):
+    global _index, _summary, _color_by, _run_query
+    _index = TrajectoryIndex(load_data(data_filepath))
+    if color_by or run_query:
+        _summary = load_or_compute_kinematics(data_filepath, _index)[1]
+    _color_by = color_by
+    _run_query = run_query
+
+
+# Render the grid of one selection file and save it in every requested format (runs in a worker process)
+def export_selection(selection_filepath: str, output_folder: str, formats: Sequence[str], dpi: int) -> List[str]:
+    fig = build_trajectory_grid(_index, load_selection_file(selection_filepath), summary=_summary,
+                                color_by=_color_by, run_query=_run_query)
+    name = os.path.splitext(os.path.basename(selection_filepath))[0]
+    paths = []
+    for fmt in formats:
+        path = os.path.join(output_folder, f"{name}.{fmt}")
+        fig.savefig(path, format=fmt, dpi=dpi)
+        paths.append(path)
+    return paths
+
+
+# Render one figure per selection file across a process pool
+def export_figures(data_filepath: str, selection_filepaths: List[str], output_folder: str = 'figures',
+                   formats: Sequence[str] = ('png',), workers: int = None, dpi: int = 100,
+                   color_by: Optional[str] = None, run_query: Optional[str] = None) -> List[str]:
+    os.makedirs(output_folder, exist_ok=True)
+    if color_by or run_query:
+        load_or_compute_kinematics(data_filepath)  # Computed once here so the workers only load it
+    paths = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(data_filepath, color_by, run_query)) as pool:
+        futures = [pool.submit(export_selection, selection_filepath, output_folder, formats, dpi)
+                   for selection_filepath in selection_filepaths]
+        for done, future in enumerate(as_completed(futures), 1):
+            paths.extend(future.result())
+            print(f"Figure {done}/{len(futures)} done")
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render trajectory grids for many run selections without a display.")
+    parser.add_argument('data', help="Compiled data (CSV, Parquet or Feather)")
+    parser.add_argument('selections', nargs='+', help="Selection CSVs in the run_selection.csv format "
+                                                      "(wildcards such as selections/*.csv are expanded)")
+    parser.add_argument('--output-folder', default='figures')
+    parser.add_argument('--format', dest='formats', nargs='+', default=['png'], choices=['png', 'svg', 'pdf'])
+    parser.add_argument('--dpi', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument('--color-by', default=None, help="Colour runs by a run summary column, e.g. mean_speed")
+    parser.add_argument('--query', default=None, help="Only plot runs whose summary matches, e.g. \"path_length > 100\"")
+    args = parser.parse_args()
+
+    # Expand wildcards here too, since the Windows shell does not
+    selection_filepaths = []
+    for pattern in args.selections:
+        selection_filepaths.extend(sorted(glob.glob(pattern)) or [pattern])
+
+    paths = export_figures(args.data, selection_filepaths, args.output_folder, args.formats, args.workers, args.dpi,
+                           args.color_by, args.query)
+    print(f"{len(paths)} files written to '{args.output_folder}'")
+
+
+if __name__ == "__main__":
+    main()
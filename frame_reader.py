@@ -0,0 +1,162 @@
+import threading
+from collections import deque
+from typing import NamedTuple, Optional
+
+import cv2
+import numpy as np
+
+from seek_index import FrameCache, FrameIndex, seek_exact
+
+
+# A decoded frame stamped with its index in the video and its presentation time in seconds
+class Frame(NamedTuple):
+    index: int
+    pts: float
+    image: np.ndarray
+
+
+# Background decoder that fills a bounded ring buffer of frames for the UI loop to consume.
+# The capture object is owned by the decode thread once `start()` is called; the UI thread
+# only talks to the reader through `get`, `drop` and `seek`.
+# With a `FrameIndex`, seeks are frame-exact and frames are stamped with indexed timestamps;
+# with a `FrameCache`, recently decoded frames are served again without touching the decoder.
+# The buffer only has to absorb decode jitter, so it holds at most `buffer_size` frames and at most
+# `buffer_bytes` of them (e.g. 5 frames of 4K footage), but always at least one.
+class FrameReader:
+    def __init__(self, cap: cv2.VideoCapture, buffer_size: int = 8,
+                 frame_index: Optional[FrameIndex] = None, cache: Optional[FrameCache] = None,
+                 buffer_bytes: int = 128 * 1024 * 1024):
+        self.cap = cap
+        self.frame_index = frame_index
+        self.cache = cache
+        self.fps = frame_index.fps if frame_index is not None else (cap.get(cv2.CAP_PROP_FPS) or 30.0)
+        if frame_index is not None and len(frame_index):
+            self.frame_count = len(frame_index)
+        else:
+            self.frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.buffer_size = buffer_size
+        self.buffer_bytes = buffer_bytes
+        self._capacity = buffer_size  # Frames the buffer holds; set from the frame size once one is decoded
+
+        self._buffer = deque()
+        self._cond = threading.Condition()
+        self._next_index = 0        # Index of the next frame the decode thread will produce
+        self._seek_request = None   # Pending frame index to jump to
+        self._generation = 0        # Bumped on every flush so in-flight frames are discarded
+        self._eof = False
+        self._stopped = False
+        self._cap_index = 0         # Index the capture will decode next (decode thread only)
+        self._thread = threading.Thread(target=self._run, name="FrameReader", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    # True once the decoder hit the end of the video and every buffered frame was consumed
+    @property
+    def eof(self) -> bool:
+        with self._cond:
+            return self._eof and not self._buffer and self._seek_request is None
+
+    # Number of frames decoded and waiting to be shown
+    def buffered(self) -> int:
+        with self._cond:
+            return len(self._buffer)
+
+    # Take the next ready frame, waiting at most `timeout` seconds for the decoder
+    def get(self, timeout: Optional[float] = None) -> Optional[Frame]:
+        with self._cond:
+            if not self._buffer and not self._eof:
+                self._cond.wait_for(lambda: self._buffer or self._eof or self._stopped, timeout)
+            if not self._buffer:
+                return None
+            frame = self._buffer.popleft()
+            self._cond.notify_all()
+            return frame
+
+    # Discard up to `count` ready frames (used when the UI falls behind); returns how many were dropped
+    def drop(self, count: int) -> int:
+        with self._cond:
+            dropped = 0
+            # Always keep one frame so the caller has something to show after catching up
+            while dropped < count and len(self._buffer) > 1:
+                self._buffer.popleft()
+                dropped += 1
+            if dropped:
+                self._cond.notify_all()
+            return dropped
+
+    # Flush the buffer and restart decoding at `frame_index`
+    def seek(self, frame_index: int):
+        frame_index = max(0, frame_index)
+        if self.frame_count > 0:
+            frame_index = min(frame_index, self.frame_count - 1)
+        with self._cond:
+            self._buffer.clear()
+            self._generation += 1
+            self._seek_request = frame_index
+            self._eof = False
+            self._cond.notify_all()
+
+    # Convert a time in seconds to the frame shown at that time
+    def index_at(self, seconds: float) -> int:
+        if self.frame_index is not None:
+            return self.frame_index.index_at(seconds)
+        return int(round(seconds * self.fps))
+
+    # Produce one frame from the cache or the decoder; returns (image, pts) or (None, None) at the end
+    def _decode(self, index: int):
+        pts = None
+        image = self.cache.get(index) if self.cache is not None else None
+        if image is None:
+            if index != self._cap_index:
+                seek_exact(self.cap, self.frame_index, index, self._cap_index)
+                self._cap_index = index
+            ret, image = self.cap.read()
+            if not ret:
+                self._cap_index = None  # Position unknown after a failed read
+                return None, None
+            self._cap_index = index + 1
+            pts = self.cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+            if self.cache is not None:
+                self.cache.put(index, image)
+
+        # Indexed timestamps are exact; otherwise trust the backend, or the nominal rate for cached frames
+        if self.frame_index is not None:
+            pts = self.frame_index.pts_at(index)
+        elif pts is None:
+            pts = index / self.fps
+        return image, pts
+
+    # Decode thread: keep the buffer topped up, honour seek requests, stop at end of video
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._stopped or self._seek_request is not None
+                                    or (not self._eof and len(self._buffer) < self._capacity))
+                if self._stopped:
+                    return
+                seek_to, self._seek_request = self._seek_request, None
+                if seek_to is not None:
+                    self._next_index = seek_to
+                generation = self._generation
+                index = self._next_index
+
+            image, pts = self._decode(index)
+
+            with self._cond:
+                if generation != self._generation:
+                    continue  # A seek happened while decoding; this frame is stale
+                if image is None:
+                    self._eof = True
+                else:
+                    self._capacity = max(min(self.buffer_size, self.buffer_bytes // max(image.nbytes, 1)), 1)
+                    self._buffer.append(Frame(index, pts, image))
+                    self._next_index = index + 1
+                self._cond.notify_all()
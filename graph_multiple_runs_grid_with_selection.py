@@ -1,14 +1,30 @@
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-from typing import List, Dict
+from matplotlib.cm import ScalarMappable
+from matplotlib.collections import LineCollection
+from matplotlib.colors import Normalize, to_rgba_array
+from matplotlib.figure import Figure
+from matplotlib.lines import Line2D
+from typing import List, Dict, Optional, Tuple, Union
 
+from decimate import axes_point_budget, decimated_xy
+from kinematics import load_or_compute_kinematics, select_runs
+from storage import read_compiled
+from trajectory_index import RUN_KEY, TrajectoryIndex, run_key
 
-# Load the data from CSV into a pandas DataFrame
+# Points drawn per pixel of subplot width, shared among the runs of the subplot by length
+# (long runs are decimated to fit; set to 0 to draw every point)
+POINTS_PER_PIXEL = 4
+
+
+# Load the compiled data (CSV, Parquet or Feather) into a pandas DataFrame
 def load_data(filepath: str) -> pd.DataFrame:
-    return pd.read_csv(filepath)
+    return read_compiled(filepath)
 
 
-# Load the CSV selection file and parse runs for each experiment and v_flow level
+# Load the CSV selection file and parse runs for each experiment and v_flow level.
+# Run numbers are returned as run labels ('Run_3'), so they can be looked up in the index directly.
 def load_selection_file(selection_filepath: str) -> Dict[str, Dict[int, List[str]]]:
     selection_df = pd.read_csv(selection_filepath, index_col=0)
     selection_dict = {}
@@ -18,17 +34,62 @@ def load_selection_file(selection_filepath: str) -> Dict[str, Dict[int, List[str
         for v_flow in selection_df.index:
             # Parse the run IDs from the cell and store as a list of strings
             runs = selection_df.at[v_flow, experiment]
-            selection_dict[experiment][int(v_flow)] = runs.split(';') if pd.notna(runs) else []
+            selection_dict[experiment][int(v_flow)] = [f"Run_{run.strip()}" for run in str(runs).split(';')
+                                                      if run.strip()] if pd.notna(runs) else []
 
     return selection_dict
 
 
-# Plot multiple static trajectories for the selected runs in a 3x3 grid
-def plot_3x3_trajectories(df: pd.DataFrame, selection_dict: Dict[str, Dict[int, List[str]]]):
-    experiments = ["Experiment_I", "Experiment_II", "Experiment_III"]
-    v_flows = [15, 20, 25]
-
-    fig, axs = plt.subplots(3, 3, figsize=(18, 18), sharex=True, sharey=True)
+# Colour of every run by a column of the run summary (see kinematics.py), and the colour scale for a colorbar
+def summary_colors(summary: pd.DataFrame, color_by: str, cmap: str = 'viridis') -> Tuple[Dict[Tuple, np.ndarray],
+                                                                                        ScalarMappable]:
+    values = summary[color_by].to_numpy(dtype=np.float64)
+    mappable = ScalarMappable(Normalize(np.nanmin(values), np.nanmax(values)), cmap)
+    keys = [run_key(*key) for key in summary[RUN_KEY].itertuples(index=False, name=None)]
+    return dict(zip(keys, mappable.to_rgba(values))), mappable
+
+
+# Draw runs on one subplot as a single LineCollection and a single scatter (instead of one line
+# artist per run), coloured per run from `run_colors` or else the colour cycle; the legend uses one
+# proxy handle per run
+def draw_runs(ax, index: TrajectoryIndex, run_keys: List[Tuple], label_prefix: str = "Run ",
+              run_colors: Optional[Dict[Tuple, np.ndarray]] = None):
+    if POINTS_PER_PIXEL > 0:
+        lengths = [len(index.xy(key)[0]) for key in run_keys]
+        budget = axes_point_budget(ax, POINTS_PER_PIXEL)
+        total = sum(lengths)
+        lines = [np.column_stack(decimated_xy(index, key, budget * length // max(total, 1)))
+                 for key, length in zip(run_keys, lengths)]
+    else:
+        lines = [np.column_stack(index.xy(key)) for key in run_keys]
+    if run_colors is not None:
+        colors = to_rgba_array([run_colors.get(key, 'grey') for key in run_keys])
+    else:
+        colors = to_rgba_array([f"C{k % 10}" for k in range(len(run_keys))])
+    ax.add_collection(LineCollection(lines, colors=colors, linestyles='-'))
+    points = np.concatenate(lines)
+    ax.scatter(points[:, 0], points[:, 1], s=36, marker='o',
+               c=np.repeat(colors, [len(line) for line in lines], axis=0))
+    ax.autoscale_view()
+    ax.legend(handles=[Line2D([], [], color=color, marker='o', linestyle='-', label=f"{label_prefix}{key[2]}")
+                       for color, key in zip(colors, run_keys)], loc="upper right", fontsize="small")
+
+
+# Build the figure of the selected runs: a grid with one column per experiment and one row per
+# v_flow level present in the data. Draws into `fig` if given, else into a new (headless) Figure.
+# With a run `summary` (see kinematics.py), runs can be coloured by one of its columns (`color_by`)
+# and limited to those matching a query on it (`run_query`, e.g. "path_length > 100").
+def build_trajectory_grid(index: TrajectoryIndex, selection_dict: Dict[str, Dict[int, List[str]]],
+                          fig: Optional[Figure] = None, summary: Optional[pd.DataFrame] = None,
+                          color_by: Optional[str] = None, run_query: Optional[str] = None) -> Figure:
+    experiments = index.sections
+    v_flows = index.v_flows
+    run_filter = select_runs(summary, run_query) if run_query else None
+    run_colors, mappable = summary_colors(summary, color_by) if color_by else (None, None)
+
+    fig = fig if fig is not None else Figure()
+    fig.set_size_inches(6 * len(experiments), 6 * len(v_flows))
+    axs = fig.subplots(len(v_flows), len(experiments), sharex=True, sharey=True, squeeze=False)
 
     # Loop over each subplot position
     for i, experiment in enumerate(experiments):
@@ -37,7 +98,6 @@ def plot_3x3_trajectories(df: pd.DataFrame, selection_dict: Dict[str, Dict[int,
 
             # Retrieve runs from selection_dict for the current experiment and v_flow
             selected_runs = selection_dict.get(experiment, {}).get(v_flow, [])
-            print("ex: ", experiment, "vf: ", v_flow, "selected_runs: ", selected_runs)
 
             # If no runs are selected, skip this plot
             if not selected_runs:
@@ -45,46 +105,61 @@ def plot_3x3_trajectories(df: pd.DataFrame, selection_dict: Dict[str, Dict[int,
                 ax.axis('off')  # Hide axes if no runs are selected
                 continue
 
-            # Prefix 'Run_' to each selected run to match the format in df
-            selected_runs = [f"Run_{run}" for run in selected_runs]
-
-            # Filter the DataFrame for the current experiment, v_flow, and selected runs
-            filtered_df = df[(df['section'] == experiment) & (df['v_flow'] == v_flow) & (df['run'].isin(selected_runs))]
-            print("filtered_df: ", filtered_df)
-
-            # Plot each run for the current experiment and v_flow level
-            has_data = False  # Track if any data is actually plotted
-            for run in selected_runs:
-                run_df = filtered_df[filtered_df['run'] == run]
-                if not run_df.empty:  # Only plot if data exists for the run
-                    ax.plot(run_df['x'], run_df['y'], marker='o', linestyle='-', label=f"Run {run}")
-                    has_data = True
+            # Look up the selected runs that exist in the data
+            run_keys = index.cell(experiment, v_flow, selected_runs)
+            if len(run_keys) < len(selected_runs):
+                found = {run for _, _, run in run_keys}
+                print(f"{experiment}, v_flow {v_flow}: no data for "
+                      f"{', '.join(run for run in selected_runs if run not in found)}")
+            if run_filter is not None:
+                run_keys = [key for key in run_keys if key in run_filter]
 
             # Set title, labels, and legend for each subplot
-            if has_data:
+            if run_keys:
+                draw_runs(ax, index, run_keys, run_colors=run_colors)
                 ax.set_title(f"{experiment}, v_flow: {v_flow}", pad=15)
                 ax.set_xlabel("X Position")
                 ax.set_ylabel("Y Position")
-                ax.legend(loc="upper right", fontsize="small")
                 ax.grid(True)
             else:
                 ax.set_title(f"No Data for {experiment}, v_flow: {v_flow}")
                 ax.axis('off')  # Hide axes if no data is available for the plot
 
     # Adjust layout to prevent overlap
-    plt.subplots_adjust(wspace=0.3, hspace=0.4)
-    plt.tight_layout()
+    fig.subplots_adjust(wspace=0.3, hspace=0.4)
+    fig.tight_layout()
+    if mappable is not None:
+        fig.colorbar(mappable, ax=axs.ravel().tolist(), label=color_by)
+    return fig
+
+
+# Plot multiple static trajectories for the selected runs in an interactive window.
+# `index` may also be the compiled DataFrame itself, as taken by the former `plot_3x3_trajectories`.
+def plot_trajectory_grid(index: Union[TrajectoryIndex, pd.DataFrame],
+                         selection_dict: Dict[str, Dict[int, List[str]]],
+                         summary: Optional[pd.DataFrame] = None, color_by: Optional[str] = None,
+                         run_query: Optional[str] = None):
+    if not isinstance(index, TrajectoryIndex):
+        index = TrajectoryIndex(index)
+    build_trajectory_grid(index, selection_dict, plt.figure(), summary, color_by, run_query)
     plt.show()
 
 
+# Former name, kept for existing callers
+plot_3x3_trajectories = plot_trajectory_grid
+
+
 # Example usage
 if __name__ == "__main__":
     data_filepath = 'compiled_data.csv'  # Path to your main data CSV file
     selection_filepath = 'run_selection.csv'  # Path to your selection CSV file
+    color_by = None   # Colour runs by a run summary column, e.g. 'mean_speed' (None: one colour per run)
+    run_query = None  # Only plot runs whose summary matches, e.g. 'path_length > 100' (None: all runs)
 
-    # Load data and run selection criteria
-    df = load_data(data_filepath)
+    # Load data, index its runs once, and load the run selection criteria
+    index = TrajectoryIndex(load_data(data_filepath))
     selection_dict = load_selection_file(selection_filepath)
+    summary = load_or_compute_kinematics(data_filepath, index)[1] if color_by or run_query else None
 
-    # Plot the 3x3 grid of trajectories based on selection
-    plot_3x3_trajectories(df, selection_dict)
+    # Plot the grid of trajectories based on selection
+    plot_trajectory_grid(index, selection_dict, summary, color_by, run_query)
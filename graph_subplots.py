@@ -1,52 +1,74 @@
 import pandas as pd
 import matplotlib.pyplot as plt
-from typing import List
+from typing import List, Optional, Union
 
+from graph_multiple_runs_grid_with_selection import draw_runs, summary_colors
+from kinematics import load_or_compute_kinematics, select_runs
+from storage import read_compiled
+from trajectory_index import TrajectoryIndex
 
-# Load the data from CSV into a pandas DataFrame
+
+# Load the compiled data (CSV, Parquet or Feather) into a pandas DataFrame
 def load_data(filepath: str) -> pd.DataFrame:
-    return pd.read_csv(filepath)
+    return read_compiled(filepath)
 
 
-# Filter DataFrame based on selected experiments, v_flows, and runs
-def filter_multiple_runs(df: pd.DataFrame, experiment: str, v_flow: int, runs: List[str]) -> pd.DataFrame:
-    return df[(df['section'] == experiment) & (df['v_flow'] == v_flow) & (df['run'].isin(runs))]
+# Rows of the selected runs of one experiment and v_flow level
+def filter_multiple_runs(index: TrajectoryIndex, experiment: str, v_flow: int, runs: List[str]) -> pd.DataFrame:
+    frames = [index.run(*key) for key in index.cell(experiment, v_flow, runs)]
+    return pd.concat(frames) if frames else index.df.iloc[:0]
 
 
-# Plot multiple static trajectories for the selected runs in a 3x3 grid
-def plot_3x3_trajectories(df: pd.DataFrame):
-    experiments = ["Experiment_I", "Experiment_II", "Experiment_III"]
-    v_flows = [15, 20, 25]
-    runs = df['run'].unique()  # Get all unique runs
+# Plot all trajectories in a grid with one column per experiment and one row per v_flow level,
+# optionally coloured by a run summary column and limited to runs matching a query on the summary.
+# `index` may also be the compiled DataFrame itself, as taken by the former `plot_3x3_trajectories`.
+def plot_trajectory_grid(index: Union[TrajectoryIndex, pd.DataFrame], summary: Optional[pd.DataFrame] = None,
+                         color_by: Optional[str] = None, run_query: Optional[str] = None):
+    if not isinstance(index, TrajectoryIndex):
+        index = TrajectoryIndex(index)
+    experiments = index.sections
+    v_flows = index.v_flows
+    run_filter = select_runs(summary, run_query) if run_query else None
+    run_colors, mappable = summary_colors(summary, color_by) if color_by else (None, None)
 
-    fig, axs = plt.subplots(3, 3, figsize=(18, 18), sharex=True, sharey=True)
+    fig, axs = plt.subplots(len(v_flows), len(experiments), figsize=(6 * len(experiments), 6 * len(v_flows)),
+                            sharex=True, sharey=True, squeeze=False)
 
     # Loop over each subplot position
     for i, experiment in enumerate(experiments):
         for j, v_flow in enumerate(v_flows):
             ax = axs[j, i]  # Access the subplot at row j, column i
-            filtered_df = df[(df['section'] == experiment) & (df['v_flow'] == v_flow)]
 
-            # Plot each run for the current experiment and v_flow level
-            for run in filtered_df['run'].unique():
-                run_df = filtered_df[filtered_df['run'] == run]
-                ax.plot(run_df['x'], run_df['y'], marker='o', linestyle='-', label=f"{run}")
+            # Plot all runs of the current experiment and v_flow level
+            run_keys = index.cell(experiment, v_flow)
+            if run_filter is not None:
+                run_keys = [key for key in run_keys if key in run_filter]
+            if run_keys:
+                draw_runs(ax, index, run_keys, label_prefix="", run_colors=run_colors)
 
-            # Set title, labels, and legend for each subplot
+            # Set title and labels for each subplot
             ax.set_title(f"{experiment}, v_flow: {v_flow}")
             ax.set_xlabel("X Position")
             ax.set_ylabel("Y Position")
-            ax.legend(loc="upper right", fontsize="small")
             ax.grid(True)
 
     plt.tight_layout()
+    if mappable is not None:
+        fig.colorbar(mappable, ax=axs.ravel().tolist(), label=color_by)
     plt.show()
 
 
+# Former name, kept for existing callers
+plot_3x3_trajectories = plot_trajectory_grid
+
+
 # Example usage
 if __name__ == "__main__":
     filepath = 'compiled_data/compiled_data.csv'  # Path to your CSV file
-    df = load_data(filepath)
+    color_by = None   # Colour runs by a run summary column, e.g. 'mean_speed' (None: one colour per run)
+    run_query = None  # Only plot runs whose summary matches, e.g. 'path_length > 100' (None: all runs)
+    index = TrajectoryIndex(load_data(filepath))
+    summary = load_or_compute_kinematics(filepath, index)[1] if color_by or run_query else None
 
-    # Plot the 3x3 grid of trajectories
-    plot_3x3_trajectories(df)
+    # Plot the grid of trajectories
+    plot_trajectory_grid(index, summary, color_by, run_query)
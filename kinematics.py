@@ -0,0 +1,182 @@
+import argparse
+import glob
+import json
+import os
+from typing import Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+from storage import read_compiled, write_compiled
+from trajectory_index import RUN_KEY, TrajectoryIndex, run_key
+
+# Bump when the computed columns or the cache layout change
+KINEMATICS_VERSION = 1
+
+# Per-point metrics, in units of the data (position units per second, per second squared)
+POINT_COLUMNS = ['vx', 'vy', 'speed', 'ax', 'ay', 'acceleration']
+# Per-run metrics of the summary table
+SUMMARY_COLUMNS = ['points', 'duration', 'path_length', 'displacement', 'mean_speed', 'max_speed',
+                   'max_acceleration', 'straightness']
+
+
+# Savitzky-Golay coefficients: row j holds the weights that evaluate, at position j of a `window`
+# point window, the least-squares polynomial of degree `order` fitted to that window
+def savgol_matrix(window: int, order: int) -> np.ndarray:
+    positions = np.arange(window) - window // 2
+    vander = np.vander(positions, order + 1, increasing=True)
+    return vander @ np.linalg.pinv(vander)
+
+
+# Savitzky-Golay smoothing of every run of a run-sorted array at once. Interior points use the centred
+# filter over the whole array; points within half a window of their run's start or end are evaluated
+# from the fit over the first or last window of the run, so no window crosses a run boundary.
+# Runs shorter than the window are left as they are.
+def smooth_runs(values: np.ndarray, starts: np.ndarray, ends: np.ndarray, window: int, order: int) -> np.ndarray:
+    window |= 1  # The window must be odd
+    half = window // 2
+    coefficients = savgol_matrix(window, order)
+    smoothed = np.correlate(values, coefficients[half], mode='same') if len(values) >= window else values.copy()
+
+    lengths = ends - starts
+    run_start = np.repeat(starts, lengths)
+    run_end = np.repeat(ends, lengths)
+    positions = np.arange(len(values))
+    long_enough = run_end - run_start >= window
+
+    # Near an edge, evaluate the edge window's fit at the point's position in that window
+    edge = long_enough & ((positions - run_start < half) | (run_end - 1 - positions < half))
+    window_start = np.where(positions - run_start < half, run_start, run_end - window)[edge]
+    rows = coefficients[positions[edge] - window_start]
+    smoothed[edge] = (rows * values[window_start[:, None] + np.arange(window)]).sum(axis=1)
+
+    smoothed[~long_enough] = values[~long_enough]
+    return smoothed
+
+
+# Backward difference of `values` over `t` for run-sorted arrays; NaN at the first point of every run
+# (where the difference would cross a run boundary) and where time does not advance
+def _run_derivative(values: np.ndarray, t: np.ndarray, first: np.ndarray) -> np.ndarray:
+    derivative = np.full(len(values), np.nan)
+    dt = np.diff(t)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        derivative[1:] = np.where(dt > 0, np.diff(values) / dt, np.nan)
+    derivative[first] = np.nan
+    return derivative
+
+
+# Per-point and per-run kinematics of every run in one vectorized pass over the index's run-sorted
+# arrays. With `smooth_window` > 0 the positions are Savitzky-Golay smoothed (per run) first.
+# Returns (points, summary): `points` has the run key, timestamp and POINT_COLUMNS in index order,
+# `summary` one row per (section, v_flow, run).
+def compute_kinematics(index: TrajectoryIndex, smooth_window: int = 0,
+                       smooth_order: int = 2) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    x, y = index.x, index.y
+    t = index.df['timestamp'].to_numpy(dtype=np.float64)
+    starts, ends = index.starts, index.ends
+    if smooth_window > smooth_order:
+        x = smooth_runs(x, starts, ends, smooth_window, smooth_order)
+        y = smooth_runs(y, starts, ends, smooth_window, smooth_order)
+
+    first = np.zeros(len(x), dtype=bool)
+    first[starts] = True
+    second = starts + 1
+    second = second[second < ends]  # Acceleration needs two velocities, so it starts one point later
+
+    vx = _run_derivative(x, t, first)
+    vy = _run_derivative(y, t, first)
+    ax = _run_derivative(vx, t, first)
+    ay = _run_derivative(vy, t, first)
+    ax[second] = np.nan
+    ay[second] = np.nan
+    speed = np.hypot(vx, vy)
+    acceleration = np.hypot(ax, ay)
+
+    points = index.df[RUN_KEY + ['timestamp']].copy()
+    for column, values in zip(POINT_COLUMNS, (vx, vy, speed, ax, ay, acceleration)):
+        points[column] = values
+
+    # Per-run reductions over the run offsets (segment lengths are 0 at run starts)
+    segment = np.zeros(len(x))
+    segment[1:] = np.hypot(np.diff(x), np.diff(y))
+    segment[first] = 0
+    last = ends - 1
+    summary = pd.DataFrame(index.keys, columns=RUN_KEY)
+    summary['points'] = ends - starts
+    summary['duration'] = t[last] - t[starts]
+    summary['path_length'] = np.add.reduceat(segment, starts) if len(starts) else []
+    summary['displacement'] = np.hypot(x[last] - x[starts], y[last] - y[starts])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        summary['mean_speed'] = summary['path_length'] / summary['duration'].where(summary['duration'] > 0)
+        summary['straightness'] = summary['displacement'] / summary['path_length'].where(summary['path_length'] > 0)
+        summary['max_speed'] = np.fmax.reduceat(speed, starts) if len(starts) else []
+        summary['max_acceleration'] = np.fmax.reduceat(acceleration, starts) if len(starts) else []
+    return points, summary[RUN_KEY + SUMMARY_COLUMNS]
+
+
+# Paths of the cached results next to the compiled data: stamp file, per-point metrics and per-run
+# summary (both in the compiled data's format, e.g. compiled_data.kinematics.csv)
+def kinematics_paths(data_path: str) -> Tuple[str, str, str]:
+    data_path = data_path.rstrip('/\\')
+    base, extension = os.path.splitext(data_path)
+    return f"{data_path}.kinematics.json", f"{base}.kinematics{extension}", f"{base}.run_summary{extension}"
+
+
+# Size and modification time identify the version of the compiled data (a file, or a Parquet dataset)
+def _data_stamp(data_path: str) -> dict:
+    if os.path.isdir(data_path):
+        stats = [os.stat(path) for path in glob.glob(os.path.join(data_path, '**', '*.parquet'), recursive=True)]
+        return {'size': sum(s.st_size for s in stats), 'mtime': max((s.st_mtime for s in stats), default=0)}
+    stat = os.stat(data_path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+# Load the cached kinematics of compiled data, computing (and saving) them on first use, when the
+# data changed, or when the smoothing settings differ. Returns (points, summary) like `compute_kinematics`.
+def load_or_compute_kinematics(data_path: str, index: Optional[TrajectoryIndex] = None, smooth_window: int = 0,
+                               smooth_order: int = 2) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    stamp_path, points_path, summary_path = kinematics_paths(data_path)
+    stamp = {'version': KINEMATICS_VERSION, 'data': _data_stamp(data_path),
+             'smooth_window': smooth_window, 'smooth_order': smooth_order}
+    if os.path.exists(stamp_path):
+        try:
+            with open(stamp_path) as f:
+                if json.load(f) == stamp:
+                    return read_compiled(points_path), read_compiled(summary_path)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable kinematics cache {stamp_path}: {e}")
+
+    if index is None:
+        index = TrajectoryIndex(read_compiled(data_path))
+    points, summary = compute_kinematics(index, smooth_window, smooth_order)
+    try:
+        write_compiled(points, points_path)
+        write_compiled(summary, summary_path)
+        with open(stamp_path, 'w') as f:
+            json.dump(stamp, f)
+        print(f"Kinematics saved to {points_path} and {summary_path}")
+    except OSError as e:
+        print(f"Could not save kinematics next to {data_path}: {e}")
+    return points, summary
+
+
+# Keys of the runs in `summary` that match a pandas query, e.g. "path_length > 100 and max_speed < 50"
+def select_runs(summary: pd.DataFrame, query: str) -> Set[Tuple]:
+    selected = summary.query(query)
+    return {run_key(*key) for key in selected[RUN_KEY].itertuples(index=False, name=None)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute (and cache) per-point and per-run kinematics of compiled data.")
+    parser.add_argument('data', help="Compiled data (CSV, Parquet or Feather)")
+    parser.add_argument('--smooth-window', type=int, default=0, help="Savitzky-Golay window in points (0: no smoothing)")
+    parser.add_argument('--smooth-order', type=int, default=2, help="Savitzky-Golay polynomial order")
+    args = parser.parse_args()
+
+    _, summary = load_or_compute_kinematics(args.data, smooth_window=args.smooth_window,
+                                            smooth_order=args.smooth_order)
+    print(summary.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import csv
+import math
+import os
+import time
+from collections import deque
+from datetime import datetime
+from typing import List, Optional
+
+import cv2
+import numpy as np
+
+from run_files import DATE_FORMAT
+
+# Stages of one pass of the playback loop, in order
+STAGES = ['read', 'track', 'render', 'overlay', 'imshow', 'wait']
+LOG_FIELDS = ['frame', 'shown_at'] + [f'{stage}_ms' for stage in STAGES] + ['interval_ms', 'lateness_ms', 'dropped']
+
+
+# Per-frame timing of the playback loop. Every pass of the loop is bracketed by `begin_pass`/`end_pass`
+# and timed stage by stage with `mark`; `frame_shown` starts the row of a newly read frame. A pass is
+# added to the row of the frame on screen when it ends, so a frame's row covers everything from its
+# read until the next frame is read (including passes that only redraw or wait for a key).
+# While disabled, every call returns after one attribute check, so the instrumentation costs next to nothing.
+class PlaybackStats:
+    def __init__(self, target_fps: float, window: int = 120):
+        self.enabled = False
+        self.target_fps = target_fps
+        self.log: List[dict] = []  # Rows of the whole session (recorded while enabled)
+        self.frames = 0
+        self.dropped = 0
+        self.late = 0
+        self._recent = deque(maxlen=window)  # Rows of the last `window` frames, for the HUD
+        self._row = None  # Row of the frame on screen
+        self._pass = dict.fromkeys(STAGES, 0.0)
+        self._last = 0.0
+        self._shown_at = None
+
+    # Switch recording (and the HUD) on or off; returns the new state
+    def toggle(self) -> bool:
+        self.enabled = not self.enabled
+        self._finish_row()
+        self._shown_at = None
+        return self.enabled
+
+    def begin_pass(self):
+        if not self.enabled:
+            return
+        self._pass = dict.fromkeys(STAGES, 0.0)
+        self._last = time.perf_counter()
+
+    # Add the time since the previous mark to `stage` of the current pass
+    def mark(self, stage: str):
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self._pass[stage] += (now - self._last) * 1000
+        self._last = now
+
+    def end_pass(self):
+        if not self.enabled or self._row is None:
+            return
+        for stage, ms in self._pass.items():
+            self._row[f'{stage}_ms'] += ms
+
+    # A new frame was read. `lateness` is how far behind schedule it is shown and `frame_interval` the
+    # target interval (both in seconds); `dropped` is how many frames were skipped to catch up.
+    def frame_shown(self, frame_index: int, lateness: float, dropped: int, frame_interval: float):
+        if not self.enabled:
+            return
+        self._finish_row()
+        now = time.perf_counter()
+        self._row = dict.fromkeys(LOG_FIELDS, 0.0)
+        self._row.update(frame=frame_index, shown_at=round(time.time(), 3), dropped=dropped,
+                         interval_ms=(now - self._shown_at) * 1000 if self._shown_at is not None else math.nan,
+                         lateness_ms=max(lateness, 0.0) * 1000)
+        self._shown_at = now
+        self.target_fps = 1 / frame_interval  # Follows speed changes
+        self.frames += 1
+        self.dropped += dropped
+        if lateness >= frame_interval:
+            self.late += 1  # Shown a whole frame or more behind schedule
+
+    # Playback stopped being continuous (pause, seek, replay), so the next interval is not a frame interval
+    def break_pacing(self):
+        self._shown_at = None
+
+    def _finish_row(self):
+        if self._row is not None:
+            self._recent.append(self._row)
+            self.log.append(self._row)
+            self._row = None
+
+    # Achieved frames per second over the recent window (NaN until there are intervals to average)
+    def achieved_fps(self) -> float:
+        intervals = [row['interval_ms'] for row in self._recent if not math.isnan(row['interval_ms'])]
+        return 1000 / np.mean(intervals) if intervals else math.nan
+
+    # Draw the live statistics in the bottom-left corner of the displayed frame
+    def draw_hud(self, image: np.ndarray):
+        if not self.enabled:
+            return
+        means = {stage: np.mean([row[f'{stage}_ms'] for row in self._recent]) if self._recent else 0.0
+                 for stage in STAGES}
+        lines = [
+            f"FPS {self.achieved_fps():.1f} / {self.target_fps:.1f}  frames {self.frames}  "
+            f"dropped {self.dropped}  late {self.late}",
+            "  ".join(f"{stage} {means[stage]:.1f}" for stage in STAGES) + " ms",
+        ]
+        y = image.shape[0] - 10 - 20 * (len(lines) - 1)
+        for line in lines:
+            cv2.putText(image, line, (10, y), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 3)
+            cv2.putText(image, line, (10, y), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 0), 1)
+            y += 20
+
+    # Write the session's timing log as a CSV in `folder`/timing (a subfolder, so compiling the folder of
+    # run CSVs does not pick it up); returns the path, or None if nothing was recorded
+    def save(self, folder: str) -> Optional[str]:
+        self._finish_row()
+        if not self.log:
+            return None
+        timing_folder = os.path.join(folder, 'timing')
+        os.makedirs(timing_folder, exist_ok=True)
+        path = os.path.join(timing_folder, f"playback_{datetime.now().strftime(DATE_FORMAT)}.csv")
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=LOG_FIELDS)
+            writer.writeheader()
+            writer.writerows(self.log)
+        return path
+
+    # One-line summary of the recorded session
+    def summary(self) -> str:
+        intervals = [row['interval_ms'] for row in self.log if not math.isnan(row['interval_ms'])]
+        fps = 1000 / np.mean(intervals) if intervals else math.nan
+        return (f"{self.frames} frames at {fps:.1f} fps (target {self.target_fps:.1f}), "
+                f"{self.dropped} dropped, {self.late} late")
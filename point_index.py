@@ -0,0 +1,81 @@
+import math
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+# In-memory index of marked points by frame number, with a coarse spatial grid per frame. Drawing the points
+# of a frame costs O(points on that frame) and finding the point nearest a click only looks at the grid
+# cells around it, however many points the session holds. Records are the same dicts as in `data`.
+class PointIndex:
+    def __init__(self, cell_size: float = 32.0):
+        self.cell_size = cell_size  # Grid cell size in source pixels
+        self._frames: Dict[int, Dict[Tuple[int, int], List[dict]]] = {}
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _cell(self, record: dict) -> Tuple[int, int]:
+        return int(math.floor(record['x'] / self.cell_size)), int(math.floor(record['y'] / self.cell_size))
+
+    def add(self, record: dict):
+        grid = self._frames.setdefault(int(record['frame']), defaultdict(list))
+        grid[self._cell(record)].append(record)
+        self._count += 1
+
+    def remove(self, record: dict):
+        frame = int(record['frame'])
+        cell = self._frames[frame][self._cell(record)]
+        cell[:] = [other for other in cell if other is not record]
+        if not cell:
+            del self._frames[frame][self._cell(record)]
+        if not self._frames[frame]:
+            del self._frames[frame]
+        self._count -= 1
+
+    # Move a record to new source coordinates, keeping the grid up to date
+    def move(self, record: dict, x: float, y: float):
+        self.remove(record)
+        record['x'] = round(x, 1)
+        record['y'] = round(y, 1)
+        self.add(record)
+
+    def clear(self):
+        self._frames.clear()
+        self._count = 0
+
+    # Rebuild the index from a list of records
+    def rebuild(self, records: Iterable[dict]):
+        self.clear()
+        for record in records:
+            self.add(record)
+
+    # Records on the frames `first` to `last` (inclusive), in frame order
+    def in_frames(self, first: int, last: int) -> List[dict]:
+        records = []
+        for frame in range(first, last + 1):
+            grid = self._frames.get(frame)
+            if grid:
+                for cell in grid.values():
+                    records.extend(cell)
+        return records
+
+    # Record nearest to (x, y) within `radius` source pixels on the frames `first` to `last`, or None
+    def nearest(self, first: int, last: int, x: float, y: float, radius: float) -> Optional[dict]:
+        cx0 = int(math.floor((x - radius) / self.cell_size))
+        cx1 = int(math.floor((x + radius) / self.cell_size))
+        cy0 = int(math.floor((y - radius) / self.cell_size))
+        cy1 = int(math.floor((y + radius) / self.cell_size))
+        best, best_distance = None, radius * radius
+        for frame in range(first, last + 1):
+            grid = self._frames.get(frame)
+            if not grid:
+                continue
+            for cx in range(cx0, cx1 + 1):
+                for cy in range(cy0, cy1 + 1):
+                    for record in grid.get((cx, cy), ()):
+                        distance = (record['x'] - x) ** 2 + (record['y'] - y) ** 2
+                        # Ties go to the later frame, i.e. the point closest to the frame on screen
+                        if distance <= best_distance:
+                            best, best_distance = record, distance
+        return best
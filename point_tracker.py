@@ -0,0 +1,96 @@
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+# Pyramidal Lucas-Kanade settings
+LK_PARAMS = dict(winSize=(21, 21), maxLevel=3,
+                 criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 30, 0.01))
+
+# Forward-backward error (pixels) at which confidence has dropped to 1/e
+FB_ERROR_SCALE = 2.0
+
+
+# Track points from one frame to the next with forward-backward pyramidal LK.
+# Only the patch around the points is converted to grayscale and searched, which keeps this far
+# faster than real time on large frames. Returns the new points (N, 2) and a confidence in [0, 1] per point.
+def track_points(prev_image: np.ndarray, next_image: np.ndarray, points: np.ndarray,
+                 patch_radius: int = 64) -> Tuple[np.ndarray, np.ndarray]:
+    points = np.asarray(points, dtype=np.float32).reshape(-1, 2)
+    if len(points) == 0:
+        return points, np.zeros(0, np.float32)
+    height, width = prev_image.shape[:2]
+
+    # Patch covering every point plus the search radius
+    x0 = max(int(points[:, 0].min()) - patch_radius, 0)
+    y0 = max(int(points[:, 1].min()) - patch_radius, 0)
+    x1 = min(int(points[:, 0].max()) + patch_radius + 1, width)
+    y1 = min(int(points[:, 1].max()) + patch_radius + 1, height)
+    if x1 <= x0 or y1 <= y0:
+        return points.copy(), np.zeros(len(points), np.float32)
+
+    prev_patch = _gray(prev_image[y0:y1, x0:x1])
+    next_patch = _gray(next_image[y0:y1, x0:x1])
+    offset = np.array([x0, y0], np.float32)
+    local = (points - offset).reshape(-1, 1, 2)
+
+    forward, status_f, _ = cv2.calcOpticalFlowPyrLK(prev_patch, next_patch, local, None, **LK_PARAMS)
+    backward, status_b, _ = cv2.calcOpticalFlowPyrLK(next_patch, prev_patch, forward, None, **LK_PARAMS)
+
+    fb_error = np.linalg.norm((backward - local).reshape(-1, 2), axis=1)
+    confidence = np.exp(-fb_error / FB_ERROR_SCALE).astype(np.float32)
+    forward = forward.reshape(-1, 2)
+
+    # Points that failed either pass or left the patch cannot be trusted
+    inside = ((forward[:, 0] >= 0) & (forward[:, 0] < x1 - x0) &
+              (forward[:, 1] >= 0) & (forward[:, 1] < y1 - y0))
+    valid = (status_f.ravel() == 1) & (status_b.ravel() == 1) & inside
+    confidence[~valid] = 0.0
+    return forward + offset, confidence
+
+
+def _gray(image: np.ndarray) -> np.ndarray:
+    return image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+# Carries a single seeded point forward frame by frame for the interactive marking tool
+class PointPropagator:
+    def __init__(self, min_confidence: float = 0.5, patch_radius: int = 64):
+        self.min_confidence = min_confidence
+        self.patch_radius = patch_radius
+        self.point = None
+        self.frame_index = None
+        self._image = None
+
+    @property
+    def active(self) -> bool:
+        return self.point is not None
+
+    # Start propagating from a point marked on `image` (frame `frame_index`)
+    def seed(self, frame_index: int, image: np.ndarray, x: float, y: float):
+        self.point = np.array([[x, y]], np.float32)
+        self.frame_index = frame_index
+        self._image = image
+
+    def stop(self):
+        self.point = None
+        self.frame_index = None
+        self._image = None
+
+    # Propagate onto the next frame. Returns (x, y, confidence), or None if `frame_index` is not the
+    # frame right after the last one (after a seek), in which case propagation stops.
+    # Below `min_confidence` the point is not advanced, so a correction can re-seed it.
+    def step(self, frame_index: int, image: np.ndarray) -> Optional[Tuple[float, float, float]]:
+        if not self.active:
+            return None
+        if frame_index != self.frame_index + 1:
+            self.stop()
+            return None
+
+        new_point, confidence = track_points(self._image, image, self.point, self.patch_radius)
+        confidence = float(confidence[0])
+        if confidence >= self.min_confidence:
+            self.point = new_point
+            self.frame_index = frame_index
+            self._image = image
+        return float(new_point[0, 0]), float(new_point[0, 1]), confidence
@@ -0,0 +1,85 @@
+import json
+import os
+from typing import Tuple
+
+import cv2
+
+from seek_index import FrameIndex, _video_stamp
+
+# Bump when the proxy encoding changes, so old proxies are rebuilt
+PROXY_VERSION = 1
+
+
+# Paths of the proxy video and of its stamp file, next to the source video
+def proxy_paths(video_path: str) -> Tuple[str, str]:
+    return f"{video_path}.proxy.avi", f"{video_path}.proxy.json"
+
+
+# Transcode the source once into a small all-intra MJPG proxy that fits `max_size`, keeping every frame
+# (so proxy frame i is source frame i) and the frame rate. Returns the number of frames written.
+def build_proxy(video_path: str, path: str, size: Tuple[int, int], fps: float) -> int:
+    cap = cv2.VideoCapture(video_path)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, size)
+    if not cap.isOpened() or not writer.isOpened():
+        cap.release()
+        writer.release()
+        raise IOError(f"Could not transcode {video_path} to {path}")
+
+    frames = 0
+    while True:
+        ret, image = cap.read()
+        if not ret:
+            break
+        writer.write(cv2.resize(image, size, interpolation=cv2.INTER_AREA))
+        frames += 1
+        if frames % 1000 == 0:
+            print(f"  {frames} frames")
+    cap.release()
+    writer.release()
+    return frames
+
+
+# Load the proxy of a video, building it on first use or when the source changed. Returns the proxy path
+# and the source frame size; proxy pixels map to source pixels through the ratio of the two widths.
+def load_or_build_proxy(video_path: str, max_size: Tuple[int, int] = (960, 540)) -> Tuple[str, Tuple[int, int]]:
+    path, stamp_path = proxy_paths(video_path)
+    stamp = {'version': PROXY_VERSION, 'video': _video_stamp(video_path), 'max_size': list(max_size)}
+    if os.path.exists(path) and os.path.exists(stamp_path):
+        try:
+            with open(stamp_path) as f:
+                saved = json.load(f)
+            if {key: saved.get(key) for key in stamp} == stamp:
+                return path, tuple(saved['source_size'])
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Ignoring unreadable proxy stamp {stamp_path}: {e}")
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f"Could not open video: {video_path}")
+    width, height = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    cap.release()
+    fit = min(max_size[0] / width, max_size[1] / height, 1.0)
+    size = (max(int(round(width * fit)), 1), max(int(round(height * fit)), 1))
+
+    print(f"Building {size[0]}x{size[1]} proxy for {video_path} ...")
+    frames = build_proxy(video_path, path, size, fps)
+    with open(stamp_path, 'w') as f:
+        json.dump({**stamp, 'source_size': [width, height], 'proxy_size': list(size), 'frames': frames}, f)
+    print(f"Proxy saved to {path} ({frames} frames)")
+    return path, (width, height)
+
+
+# Open a proxy for playback. OpenCV's own MJPEG reader seeks straight to any frame of an all-intra
+# AVI (a few milliseconds); the FFmpeg backend is the fallback.
+def open_proxy(path: str) -> cv2.VideoCapture:
+    cap = cv2.VideoCapture(path, cv2.CAP_OPENCV_MJPEG)
+    if not cap.isOpened():
+        cap = cv2.VideoCapture(path)
+    return cap
+
+
+# Frame index for the proxy: the source's timestamps (frames correspond one to one) with every frame
+# a keyframe, so seeks land directly on their target
+def proxy_frame_index(source_index: FrameIndex) -> FrameIndex:
+    return FrameIndex(source_index.pts, list(range(len(source_index))), source_index.fps)
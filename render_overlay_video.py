@@ -0,0 +1,230 @@
+import argparse
+import glob
+import os
+import shutil
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+import pandas as pd
+from matplotlib import colormaps
+
+from seek_index import FrameIndex, load_or_build_index, seek_exact
+from storage import read_compiled
+from trajectory_index import RUN_KEY, run_key
+
+# Codec per output extension; both can be written by any OpenCV build
+FOURCC = {'.mp4': 'mp4v', '.avi': 'MJPG'}
+
+# Per-process state set up by `_init_worker`
+_video_path = None
+_frame_index = None
+_tracks = None
+_options = None
+
+
+# Load the (persisted) frame index and take the tracks to draw once per worker process
+def _init_worker(video_path: str, tracks: List[dict], options: dict):
+    global _video_path, _frame_index, _tracks, _options
+    _video_path = video_path
+    _frame_index = load_or_build_index(video_path)
+    _tracks = tracks
+    _options = options
+
+
+# Read the marked points to draw: compiled data (CSV, Parquet or Feather) and/or per-run CSVs. Points must be
+# in source-video pixels, i.e. compiled from the marking tool's output before `transform_data.py`.
+def load_points(paths: List[str]) -> pd.DataFrame:
+    frames = [read_compiled(path) for path in paths]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=RUN_KEY + ['x', 'y'])
+
+
+# Turn the points into one track per run: the run's position on every frame from its first to its last
+# point, linearly interpolated between the marked frames (or held at the last marked point when
+# `interpolate` is off). Frames come from the `frame` column, or from the timestamps where it is missing.
+def build_tracks(df: pd.DataFrame, frame_index: FrameIndex, interpolate: bool = True,
+                 cmap: str = 'tab10') -> List[dict]:
+    df = df.dropna(subset=RUN_KEY + ['x', 'y'])
+    # Copied: with copy-on-write the column's own array is read-only, and missing frames are filled in below
+    frames = df['frame'].to_numpy(dtype=np.float64, copy=True) if 'frame' in df else np.full(len(df), np.nan)
+    missing = np.isnan(frames)
+    if missing.any():
+        frames[missing] = [frame_index.index_at(t) for t in df['timestamp'].to_numpy(dtype=np.float64)[missing]]
+    df = df.assign(_frame=frames.astype(np.int64))
+
+    colors = colormaps[cmap].colors
+    tracks = []
+    for number, (key, run_df) in enumerate(df.groupby(RUN_KEY, sort=True, observed=True)):
+        # One point per frame; a later point on the same frame (e.g. a correction) wins
+        run_df = run_df.sort_values('_frame', kind='stable').drop_duplicates('_frame', keep='last')
+        marked = run_df['_frame'].to_numpy()
+        first, last = int(marked[0]), int(marked[-1])
+        dense = np.arange(first, last + 1)
+        if interpolate:
+            x = np.interp(dense, marked, run_df['x'].to_numpy(dtype=np.float64))
+            y = np.interp(dense, marked, run_df['y'].to_numpy(dtype=np.float64))
+        else:
+            held = np.searchsorted(marked, dense, side='right') - 1
+            x = run_df['x'].to_numpy(dtype=np.float64)[held]
+            y = run_df['y'].to_numpy(dtype=np.float64)[held]
+        r, g, b = colors[number % len(colors)][:3]
+        section, v_flow, run = run_key(*key)
+        tracks.append({
+            'label': f"{section} {v_flow} {run}",
+            'color': (int(b * 255), int(g * 255), int(r * 255)),
+            'first': first,
+            'last': last,
+            'points': np.column_stack([x, y]),
+        })
+    return tracks
+
+
+# Draw every track that is visible on `frame`: its polyline so far, a dot at its head and its label.
+# A track stays on screen for `linger` frames after its last point.
+def draw_tracks(image: np.ndarray, tracks: List[dict], frame: int, scale: float, linger: int,
+                thickness: int = 2):
+    for track in tracks:
+        if not track['first'] <= frame <= track['last'] + linger:
+            continue
+        end = min(frame, track['last']) - track['first'] + 1
+        # Fixed-point coordinates (4 fractional bits) keep the lines smooth at sub-pixel positions
+        points = np.round(track['points'][:end] * (scale * 16)).astype(np.int32)
+        cv2.polylines(image, [points], False, track['color'], thickness, cv2.LINE_AA, shift=4)
+        head = tuple(points[-1])
+        cv2.circle(image, head, 5 * 16, track['color'], -1, cv2.LINE_AA, shift=4)
+        label_at = (int(head[0]) // 16 + 8, int(head[1]) // 16 - 8)
+        # Dark outline first, so the label reads on any background
+        cv2.putText(image, track['label'], label_at, cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 3, cv2.LINE_AA)
+        cv2.putText(image, track['label'], label_at, cv2.FONT_HERSHEY_SIMPLEX, 0.5, track['color'], 1, cv2.LINE_AA)
+
+
+# Render the frames `start` to `end` (exclusive) with the tracks drawn on into their own video file
+# (runs in a worker process); returns the path and the number of frames written
+def render_segment(start: int, end: int, path: str) -> Tuple[str, int]:
+    cap = cv2.VideoCapture(_video_path)
+    seek_exact(cap, _frame_index, start)
+    scale = _options['scale']
+    size = (int(round(cap.get(cv2.CAP_PROP_FRAME_WIDTH) * scale)),
+            int(round(cap.get(cv2.CAP_PROP_FRAME_HEIGHT) * scale)))
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*_options['fourcc']), _frame_index.fps, size)
+
+    # Only the tracks that show up in this segment
+    linger = _options['linger']
+    tracks = [track for track in _tracks if track['first'] < end and track['last'] + linger >= start]
+
+    written = 0
+    for frame in range(start, end):
+        ret, image = cap.read()
+        if not ret:
+            break
+        if scale != 1:
+            image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        draw_tracks(image, tracks, frame, scale, linger)
+        cv2.putText(image, f"{_frame_index.pts_at(frame):.2f}s", (10, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5,
+                    (255, 255, 255), 1, cv2.LINE_AA)
+        writer.write(image)
+        written += 1
+    cap.release()
+    writer.release()
+    return path, written
+
+
+# Join the segment files into `output_path`: a stream copy with ffmpeg when it is installed (no re-encoding),
+# otherwise by decoding and re-encoding them with OpenCV
+def concatenate_segments(paths: List[str], output_path: str, fourcc: str, fps: float):
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg:
+        list_path = f"{output_path}.segments.txt"
+        with open(list_path, 'w') as f:
+            for path in paths:
+                f.write(f"file '{os.path.abspath(path)}'\n")
+        subprocess.run([ffmpeg, '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', list_path,
+                        '-c', 'copy', output_path], check=True)
+        os.remove(list_path)
+        return
+
+    writer = None
+    for path in paths:
+        cap = cv2.VideoCapture(path)
+        while True:
+            ret, image = cap.read()
+            if not ret:
+                break
+            if writer is None:
+                writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*fourcc), fps,
+                                         (image.shape[1], image.shape[0]))
+            writer.write(image)
+        cap.release()
+    if writer is not None:
+        writer.release()
+
+
+# Render the video with the runs' trajectories drawn on it, split into segments of about `segment_seconds`
+# that are encoded across a process pool and then joined. Without `whole_video`, only the frames where a
+# track is visible are rendered (from the first run's start to the last run's end).
+def render_overlay_video(video_path: str, data_paths: List[str], output_path: str, workers: Optional[int] = None,
+                         segment_seconds: float = 60, scale: float = 1.0, interpolate: bool = True,
+                         linger_seconds: float = 2.0, whole_video: bool = False) -> str:
+    extension = os.path.splitext(output_path)[1].lower()
+    if extension not in FOURCC:
+        raise ValueError(f"Unsupported output format '{extension}' (use {', '.join(FOURCC)})")
+    frame_index = load_or_build_index(video_path)  # Built once here so the workers only load it
+    tracks = build_tracks(load_points(data_paths), frame_index, interpolate)
+    if not tracks:
+        raise ValueError("No points to draw")
+    linger = int(round(linger_seconds * frame_index.fps))
+
+    if whole_video:
+        first, last = 0, len(frame_index)
+    else:
+        first = min(track['first'] for track in tracks)
+        last = min(max(track['last'] for track in tracks) + linger + 1, len(frame_index))
+    step = max(int(segment_seconds * frame_index.fps), 1)
+    segments_folder = f"{output_path}.segments"
+    os.makedirs(segments_folder, exist_ok=True)
+    segments = [(start, min(start + step, last), os.path.join(segments_folder, f"segment-{number:05d}{extension}"))
+                for number, start in enumerate(range(first, last, step))]
+    print(f"Rendering {len(tracks)} runs over {last - first} frames in {len(segments)} segments")
+
+    options = {'scale': scale, 'fourcc': FOURCC[extension], 'linger': linger}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(video_path, tracks, options)) as pool:
+        futures = [pool.submit(render_segment, *segment) for segment in segments]
+        for done, future in enumerate(as_completed(futures), 1):
+            future.result()
+            print(f"Segment {done}/{len(futures)} done")
+
+    concatenate_segments([path for _, _, path in segments], output_path, FOURCC[extension], frame_index.fps)
+    shutil.rmtree(segments_folder)
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render a review video with the marked trajectories drawn on it, "
+                                                 "without a display.")
+    parser.add_argument('video', help="Video the points were marked on")
+    parser.add_argument('data', nargs='+', help="Compiled data and/or per-run CSVs in source-video pixels "
+                                                "(wildcards such as output_data/*.csv are expanded)")
+    parser.add_argument('--output', default='overlay.mp4', help="Output video (.mp4 or .avi)")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument('--segment-seconds', type=float, default=60, help="Length of the segments encoded in parallel")
+    parser.add_argument('--scale', type=float, default=1.0, help="Scale the output, e.g. 0.5 for half size")
+    parser.add_argument('--no-interpolate', action='store_true', help="Hold points between marked frames")
+    parser.add_argument('--linger-seconds', type=float, default=2.0, help="Keep a run on screen after it ends")
+    parser.add_argument('--whole-video', action='store_true', help="Render the whole video, not just the runs")
+    args = parser.parse_args()
+
+    # Expand wildcards here too, since the Windows shell does not
+    data_paths = []
+    for pattern in args.data:
+        data_paths.extend(sorted(glob.glob(pattern)) or [pattern])
+
+    path = render_overlay_video(args.video, data_paths, args.output, args.workers, args.segment_seconds, args.scale,
+                                not args.no_interpolate, args.linger_seconds, args.whole_video)
+    print(f"Overlay video saved to {path}")
+
+
+if __name__ == "__main__":
+    main()
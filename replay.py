@@ -0,0 +1,58 @@
+import math
+from collections import defaultdict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+import pandas as pd
+
+from seek_index import FrameIndex, seek_exact
+
+
+# Load the marked points of a per-run CSV written by `save_data`
+def load_replay_entries(csv_path: str) -> List[dict]:
+    return pd.read_csv(csv_path).to_dict('records')
+
+
+# Frame an entry was marked on: the recorded frame number if present, otherwise looked up from its timestamp
+def entry_frame(entry: dict, frame_index: FrameIndex) -> int:
+    frame = entry.get('frame')
+    if frame is not None and not (isinstance(frame, float) and math.isnan(frame)):
+        return int(frame)
+    return frame_index.index_at(entry['timestamp'])
+
+
+# Group entries by frame and order the groups by frame number (i.e. by timestamp)
+def plan_replay(entries: List[dict], frame_index: FrameIndex) -> List[Tuple[int, List[dict]]]:
+    by_frame: Dict[int, List[dict]] = defaultdict(list)
+    for entry in entries:
+        by_frame[entry_frame(entry, frame_index)].append(entry)
+    return sorted(by_frame.items())
+
+
+# Longest gap worth decoding through instead of seeking: about one GOP, since a seek has to
+# decode from the previous keyframe anyway
+def default_max_gap(frame_index: FrameIndex) -> int:
+    if frame_index.keyframes and len(frame_index.keyframes) > 1:
+        return max(int(np.median(np.diff(frame_index.keyframes))), 1)
+    return max(int(frame_index.fps), 1)
+
+
+# Decode the planned frames in order, grabbing forward across short gaps and seeking only across long ones
+def iter_replay_frames(cap: cv2.VideoCapture, frame_index: FrameIndex, plan: List[Tuple[int, List[dict]]],
+                       max_gap: Optional[int] = None) -> Iterator[Tuple[int, np.ndarray, List[dict]]]:
+    if max_gap is None:
+        max_gap = default_max_gap(frame_index)
+
+    position = None  # Index the capture will decode next
+    for frame_number, entries in plan:
+        if position is not None and 0 <= frame_number - position <= max_gap:
+            for _ in range(frame_number - position):
+                cap.grab()
+        else:
+            seek_exact(cap, frame_index, frame_number, position)
+        ret, image = cap.read()
+        if not ret:
+            break
+        position = frame_number + 1
+        yield frame_number, image, entries
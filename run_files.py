@@ -0,0 +1,32 @@
+import os
+from datetime import datetime
+from typing import Optional
+
+# Date format in the per-run CSV filenames
+DATE_FORMAT = "%Y%m%d_%H%M%S"
+
+
+# Build the per-run filename: <section>_<v_flow>_Run_<run_number>_<timestamp>.csv
+def run_filename(section: str, v_flow, run_number: int, recorded_at: Optional[datetime] = None) -> str:
+    recorded_at = recorded_at or datetime.now()
+    return f'{section}_{v_flow}_Run_{run_number}_{recorded_at.strftime(DATE_FORMAT)}.csv'
+
+
+# Parse a per-run filename back into its parts; raises ValueError if it does not follow the convention.
+# The section name may itself contain underscores (e.g. Experiment_I), so the name is parsed from the right.
+def parse_run_filename(filename: str) -> dict:
+    stem, ext = os.path.splitext(os.path.basename(filename))
+    parts = stem.split('_')
+    if ext.lower() != '.csv' or len(parts) < 6 or parts[-4] != 'Run':
+        raise ValueError(f"'{filename}' does not match <section>_<v_flow>_Run_<n>_<timestamp>.csv")
+    return {
+        'section': '_'.join(parts[:-5]),
+        'v_flow': int(parts[-5]) if parts[-5].lstrip('-').isdigit() else parts[-5],
+        'run': f'Run_{int(parts[-3])}',
+        'recorded_at': datetime.strptime(f'{parts[-2]}_{parts[-1]}', DATE_FORMAT),
+    }
+
+
+# Run number from a run label such as 'Run_3'
+def run_number_of(run_label) -> int:
+    return int(str(run_label).rsplit('_', 1)[-1])
@@ -0,0 +1,197 @@
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from seek_index import FrameIndex, _video_stamp, load_or_build_index, seek_exact
+
+# Bump when the activity signal or the way intervals are proposed changes, so cached proposals are redone
+SEGMENTATION_VERSION = 1
+
+# Default pre-pass settings; they are part of the cache stamp
+DEFAULT_PARAMETERS = {
+    'stride': 5,               # Sample every n-th frame
+    'width': 160,              # Width the sampled frames are shrunk to
+    'pixel_threshold': 12,     # Grey-level change that counts a pixel as moving
+    'smooth_seconds': 1.0,     # Moving-average window of the activity signal
+    'sensitivity': 6.0,        # Active above the idle median plus this many median absolute deviations
+    'min_activity': 0.002,     # ... and above this fraction of moving pixels
+    'min_run_seconds': 1.0,    # Drop shorter intervals
+    'min_gap_seconds': 2.0,    # Merge intervals closer together than this
+    'pad_seconds': 0.5,        # Start each interval this much early and end it this much late
+}
+
+# Per-process state set up by `_init_worker`
+_video_path = None
+_frame_index = None
+
+
+# Load the (persisted) frame index once per worker process
+def _init_worker(video_path: str):
+    global _video_path, _frame_index
+    _video_path = video_path
+    _frame_index = load_or_build_index(video_path)
+
+
+# Path of the cached run proposals that sit next to the video
+def runs_path(video_path: str) -> str:
+    return f"{video_path}.runs.json"
+
+
+# Activity of the sampled frames `first`, `first + stride`, ... before `end` (runs in a worker process):
+# the fraction of pixels that changed by more than `pixel_threshold` since the previous sample. Frames
+# are shrunk to `width` and blurred so that compression noise and fine texture do not count as motion.
+# The chunk also decodes the sample before `first`, so chunks join up without a gap in the signal.
+def activity_chunk(first: int, end: int, stride: int, width: int,
+                   pixel_threshold: int) -> Tuple[np.ndarray, np.ndarray]:
+    start = max(first - stride, 0)
+    cap = cv2.VideoCapture(_video_path)
+    seek_exact(cap, _frame_index, start)
+
+    frames, samples = [], []
+    size = None
+    for frame in range(start, end):
+        if (frame - start) % stride:
+            if not cap.grab():
+                break
+            continue
+        ret, image = cap.read()
+        if not ret:
+            break
+        if size is None:
+            height, image_width = image.shape[:2]
+            size = (width, max(int(round(height * width / image_width)), 1))
+        small = cv2.resize(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), size, interpolation=cv2.INTER_AREA)
+        samples.append(cv2.GaussianBlur(small, (5, 5), 0))
+        frames.append(frame)
+    cap.release()
+
+    if len(samples) < 2:
+        return np.empty(0, np.int64), np.empty(0)
+    stack = np.stack(samples).astype(np.int16)
+    moving = np.abs(np.diff(stack, axis=0)) > pixel_threshold
+    activity = moving.mean(axis=(1, 2))
+    frames = np.array(frames[1:], np.int64)
+    if first == 0:
+        # The first frame has no predecessor; give it the activity of the second
+        frames = np.concatenate([[0], frames])
+        activity = np.concatenate([activity[:1], activity])
+    return frames, activity
+
+
+# Decode the video at reduced resolution and frame stride across a process pool, chunk by chunk,
+# and return the sampled frame indices with their activity. `workers=1` runs in this process instead
+# (for callers such as the marking tool, whose scripts cannot be re-imported by spawned workers).
+def activity_signal(video_path: str, frame_index: FrameIndex, stride: int = 5, width: int = 160,
+                    pixel_threshold: int = 12, workers: Optional[int] = None,
+                    chunk_seconds: float = 60) -> Tuple[np.ndarray, np.ndarray]:
+    # Chunks start on a sample so every chunk samples the same frames a single pass would
+    step = max(int(chunk_seconds * frame_index.fps) // stride, 1) * stride
+    chunks = [(first, min(first + step, len(frame_index)), stride, width, pixel_threshold)
+              for first in range(0, max(len(frame_index), 1), step)]
+    if workers == 1:
+        global _video_path, _frame_index
+        _video_path, _frame_index = video_path, frame_index
+        results = [activity_chunk(*chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(video_path,)) as pool:
+            results = list(pool.map(activity_chunk, *zip(*chunks)))
+    frames = np.concatenate([frames for frames, _ in results]) if results else np.empty(0, np.int64)
+    activity = np.concatenate([activity for _, activity in results]) if results else np.empty(0)
+    return frames, activity
+
+
+# Propose run intervals from the activity signal. Most footage is idle, so the idle level and its spread
+# are taken from the median and the median absolute deviation of the smoothed signal; samples well
+# above it are active. Returns (first frame, last frame) pairs.
+def propose_intervals(frames: np.ndarray, activity: np.ndarray, fps: float, stride: int, smooth_seconds: float,
+                      sensitivity: float, min_activity: float, min_run_seconds: float, min_gap_seconds: float,
+                      pad_seconds: float, frame_count: int) -> List[Tuple[int, int]]:
+    if len(activity) == 0:
+        return []
+    samples_per_second = fps / stride
+    window = max(int(round(smooth_seconds * samples_per_second)), 1)
+    smoothed = np.convolve(activity, np.ones(window) / window, mode='same')
+    baseline = np.median(smoothed)
+    spread = np.median(np.abs(smoothed - baseline))
+    active = smoothed > max(baseline + sensitivity * spread, min_activity)
+
+    # Rising and falling edges of the active mask give the sample ranges [start, stop)
+    edges = np.diff(np.concatenate([[0], active.astype(np.int8), [0]]))
+    starts, stops = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    if len(starts) == 0:
+        return []
+
+    # Merge intervals separated by short quiet gaps, then drop the short ones
+    gap = int(round(min_gap_seconds * samples_per_second))
+    keep = np.concatenate([[True], starts[1:] - stops[:-1] > gap])
+    starts = starts[keep]
+    stops = np.concatenate([stops[np.flatnonzero(keep)[1:] - 1], stops[-1:]])
+    long_enough = (frames[stops - 1] - frames[starts]) >= min_run_seconds * fps
+    starts, stops = starts[long_enough], stops[long_enough]
+
+    pad = int(round(pad_seconds * fps))
+    return [(max(int(frames[start]) - pad, 0), min(int(frames[stop - 1]) + stride - 1 + pad, frame_count - 1))
+            for start, stop in zip(starts, stops)]
+
+
+# Load the cached run proposals of a video, running the pre-pass on first use or when the video or the
+# settings changed. Returns (first frame, last frame) pairs in frame order.
+def load_or_segment(video_path: str, frame_index: Optional[FrameIndex] = None, workers: Optional[int] = None,
+                    **parameters) -> List[Tuple[int, int]]:
+    parameters = {**DEFAULT_PARAMETERS, **parameters}
+    path = runs_path(video_path)
+    stamp = {'version': SEGMENTATION_VERSION, 'video': _video_stamp(video_path), 'parameters': parameters}
+    if os.path.exists(path):
+        try:
+            with open(path) as f:
+                saved = json.load(f)
+            if {key: saved.get(key) for key in stamp} == stamp:
+                return [(interval['start'], interval['end']) for interval in saved['intervals']]
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Ignoring unreadable run proposals {path}: {e}")
+
+    frame_index = frame_index or load_or_build_index(video_path)  # Built here so the workers only load it
+    print(f"Finding runs in {video_path} ...")
+    frames, activity = activity_signal(video_path, frame_index, parameters['stride'], parameters['width'],
+                                       parameters['pixel_threshold'], workers)
+    intervals = propose_intervals(frames, activity, frame_index.fps, parameters['stride'],
+                                  parameters['smooth_seconds'], parameters['sensitivity'], parameters['min_activity'],
+                                  parameters['min_run_seconds'], parameters['min_gap_seconds'],
+                                  parameters['pad_seconds'], len(frame_index))
+    try:
+        with open(path, 'w') as f:
+            json.dump({**stamp, 'intervals': [
+                {'start': start, 'end': end, 'start_time': round(frame_index.pts_at(start), 3),
+                 'end_time': round(frame_index.pts_at(end), 3)} for start, end in intervals]}, f, indent=1)
+        print(f"{len(intervals)} proposed runs saved to {path}")
+    except OSError as e:
+        print(f"Could not save run proposals to {path}: {e}")
+    return intervals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Propose run intervals in a video from its motion.")
+    parser.add_argument('video', help="Video file to segment")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument('--stride', type=int, default=DEFAULT_PARAMETERS['stride'], help="Sample every n-th frame")
+    parser.add_argument('--width', type=int, default=DEFAULT_PARAMETERS['width'],
+                        help="Width sampled frames are shrunk to")
+    parser.add_argument('--sensitivity', type=float, default=DEFAULT_PARAMETERS['sensitivity'],
+                        help="Lower finds weaker motion")
+    args = parser.parse_args()
+
+    frame_index = load_or_build_index(args.video)
+    intervals = load_or_segment(args.video, frame_index, args.workers, stride=args.stride, width=args.width,
+                                sensitivity=args.sensitivity)
+    for number, (start, end) in enumerate(intervals, 1):
+        print(f"Run {number}: frames {start}-{end} "
+              f"({frame_index.pts_at(start):.2f}s - {frame_index.pts_at(end):.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+import argparse
+import bisect
+import json
+import os
+from collections import OrderedDict
+from typing import List, Optional
+
+import cv2
+import numpy as np
+
+# Bump when the on-disk layout of the index file (or how it is built) changes
+INDEX_VERSION = 2
+
+
+# Frame-index -> presentation time / keyframe table for one video
+class FrameIndex:
+    def __init__(self, pts: List[float], keyframes: Optional[List[int]], fps: float):
+        self.pts = pts                  # Presentation time (seconds) of every frame, in decode order
+        self.keyframes = keyframes      # Sorted keyframe indices, or None if the backend cannot report them
+        self.fps = fps
+
+    def __len__(self) -> int:
+        return len(self.pts)
+
+    # Presentation time of a frame, extrapolated at the nominal frame rate past the end of the table
+    def pts_at(self, frame_index: int) -> float:
+        if 0 <= frame_index < len(self.pts):
+            return self.pts[frame_index]
+        last = len(self.pts) - 1
+        return (self.pts[last] if last >= 0 else 0.0) + (frame_index - last) / self.fps
+
+    # Frame shown at `seconds`: the last frame whose presentation time is not after it
+    def index_at(self, seconds: float) -> int:
+        if not self.pts:
+            return int(round(seconds * self.fps))
+        # Half a frame of slack so timestamps rounded when they were written still map to their frame
+        position = bisect.bisect_right(self.pts, seconds + 0.5 / self.fps) - 1
+        return min(max(position, 0), len(self.pts) - 1)
+
+    # Nearest keyframe at or before `frame_index`, or None when keyframes are unknown
+    def keyframe_before(self, frame_index: int) -> Optional[int]:
+        if not self.keyframes:
+            return None
+        position = bisect.bisect_right(self.keyframes, frame_index) - 1
+        return self.keyframes[max(position, 0)]
+
+
+# Path of the persisted index that sits next to the video
+def index_path(video_path: str) -> str:
+    return f"{video_path}.index.json"
+
+
+# Size and modification time identify the version of the video an index was built from
+def _video_stamp(video_path: str) -> dict:
+    stat = os.stat(video_path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+# Scan the whole video once, reading packets without decoding them where the backend allows it.
+# Packets come in decode order; with B-frames their timestamps are not monotonic, so the timestamps are
+# sorted into presentation (display) order and the keyframes are mapped to their display indices.
+def scan_video(video_path: str) -> FrameIndex:
+    keyframes = []
+    cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1])
+    raw_mode = cap.isOpened() and hasattr(cv2, 'CAP_PROP_LRF_HAS_KEY_FRAME')
+    if not raw_mode:
+        # Fall back to a regular (decoding) scan; keyframes stay unknown and seeks use the backend
+        cap.release()
+        cap = cv2.VideoCapture(video_path)
+        keyframes = None
+    if not cap.isOpened():
+        raise IOError(f"Could not open video: {video_path}")
+
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    pts = []
+    while cap.grab():
+        pts.append(cap.get(cv2.CAP_PROP_POS_MSEC) / 1000)
+        if raw_mode and cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+            keyframes.append(pts[-1])  # By timestamp for now; mapped to a display index below
+    cap.release()
+
+    pts.sort()
+    if keyframes:
+        keyframes = sorted({bisect.bisect_left(pts, keyframe_pts) for keyframe_pts in keyframes})
+    else:
+        keyframes = None
+    return FrameIndex(pts, keyframes, fps)
+
+
+# Decode the whole video once and compare every frame's timestamp with the index; returns the frame numbers
+# that disagree by more than `tolerance` seconds (default: a quarter frame), plus any frames the index
+# has but the decoder does not, or the other way round
+def verify_index(video_path: str, frame_index: FrameIndex, tolerance: Optional[float] = None) -> List[int]:
+    tolerance = 0.25 / frame_index.fps if tolerance is None else tolerance
+    cap = cv2.VideoCapture(video_path)
+    mismatches = []
+    decoded = 0
+    while cap.grab():
+        seconds = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+        if decoded >= len(frame_index) or abs(frame_index.pts[decoded] - seconds) > tolerance:
+            mismatches.append(decoded)
+        decoded += 1
+    cap.release()
+    mismatches.extend(range(decoded, len(frame_index)))
+    return mismatches
+
+
+# Load the persisted index for a video, building (and saving) it on first use or when the video changed
+def load_or_build_index(video_path: str) -> FrameIndex:
+    path = index_path(video_path)
+    stamp = _video_stamp(video_path)
+    if os.path.exists(path):
+        try:
+            with open(path) as f:
+                saved = json.load(f)
+            if saved.get('version') == INDEX_VERSION and saved.get('video') == stamp:
+                return FrameIndex(saved['pts'], saved['keyframes'], saved['fps'])
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Ignoring unreadable frame index {path}: {e}")
+
+    print(f"Building frame index for {video_path} ...")
+    frame_index = scan_video(video_path)
+    try:
+        with open(path, 'w') as f:
+            json.dump({'version': INDEX_VERSION, 'video': stamp, 'fps': frame_index.fps,
+                       'pts': [round(t, 6) for t in frame_index.pts], 'keyframes': frame_index.keyframes}, f)
+        print(f"Frame index saved to {path} ({len(frame_index)} frames)")
+    except OSError as e:
+        print(f"Could not save frame index to {path}: {e}")
+    return frame_index
+
+
+# Position `cap` so that its next read returns exactly `target`.
+# `position` is the index the capture would read next, if known; when it lies between the
+# target's keyframe and the target, we decode forward from there instead of seeking.
+def seek_exact(cap: cv2.VideoCapture, frame_index: Optional[FrameIndex], target: int,
+               position: Optional[int] = None):
+    keyframe = frame_index.keyframe_before(target) if frame_index is not None else None
+    if keyframe is None:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+        return
+
+    if position is None or not keyframe <= position <= target:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, keyframe)
+        position = keyframe
+    for _ in range(target - position):
+        if not cap.grab():
+            break
+
+
+# LRU cache of decoded frames bounded by a memory budget
+class FrameCache:
+    def __init__(self, budget_bytes: int = 512 * 1024 * 1024):
+        self.budget_bytes = budget_bytes
+        self.used_bytes = 0
+        self._frames = OrderedDict()
+
+    def __contains__(self, frame_index: int) -> bool:
+        return frame_index in self._frames
+
+    def get(self, frame_index: int) -> Optional[np.ndarray]:
+        image = self._frames.get(frame_index)
+        if image is not None:
+            self._frames.move_to_end(frame_index)
+        return image
+
+    def put(self, frame_index: int, image: np.ndarray):
+        if image.nbytes > self.budget_bytes:
+            return
+        old = self._frames.pop(frame_index, None)
+        if old is not None:
+            self.used_bytes -= old.nbytes
+        self._frames[frame_index] = image
+        self.used_bytes += image.nbytes
+        while self.used_bytes > self.budget_bytes:
+            _, evicted = self._frames.popitem(last=False)
+            self.used_bytes -= evicted.nbytes
+
+    def clear(self):
+        self._frames.clear()
+        self.used_bytes = 0
+
+
+# Build (or load) the frame index of a video and optionally check it against a full decoding pass
+def main():
+    parser = argparse.ArgumentParser(description="Build the frame index of a video and check it.")
+    parser.add_argument('video', help="Video file to index")
+    parser.add_argument('--verify', action='store_true', help="Compare the index with a full decoding pass")
+    args = parser.parse_args()
+
+    frame_index = load_or_build_index(args.video)
+    keyframes = len(frame_index.keyframes) if frame_index.keyframes else 'unknown'
+    print(f"{len(frame_index)} frames at {frame_index.fps:.3f} fps, keyframes: {keyframes}")
+    if args.verify:
+        mismatches = verify_index(args.video, frame_index)
+        if mismatches:
+            print(f"{len(mismatches)} frames disagree with the decoder, first at frame {mismatches[0]}")
+        else:
+            print("Index matches the decoded timestamps of every frame")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+import argparse
+import hashlib
+import os
+import shutil
+from typing import Iterable, Iterator, List, Optional
+
+import pandas as pd
+
+# Bytes at the end of a compiled file hashed to recognise it later (see `tail_sha1`)
+TAIL_BYTES = 64 * 1024
+
+# Run key columns, stored as categoricals; compiled data is sorted and partitioned by them
+CATEGORY_COLUMNS = ['section', 'v_flow', 'run']
+PARTITION_COLUMNS = ['section', 'v_flow']
+# Coordinate and time columns, stored as float64 arrays
+FLOAT_COLUMNS = ['x', 'y', 'timestamp']
+
+
+# Storage format of a path, from its extension: a partitioned Parquet dataset, a Feather file, or CSV
+def storage_format(path: str) -> str:
+    extension = os.path.splitext(path.rstrip('/\\'))[1].lower()
+    if extension == '.parquet':
+        return 'parquet'
+    if extension == '.feather':
+        return 'feather'
+    return 'csv'
+
+
+def _require_pyarrow(path: str):
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise ImportError(f"Reading or writing '{path}' needs pyarrow (pip install pyarrow)") from None
+
+
+# Give compiled data its typed layout: categorical run keys and float coordinates/timestamps
+def to_columnar(df: pd.DataFrame) -> pd.DataFrame:
+    for column in CATEGORY_COLUMNS:
+        if column in df and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype('category')
+    for column in FLOAT_COLUMNS:
+        if column in df and df[column].dtype != 'float64':
+            df[column] = pd.to_numeric(df[column], errors='coerce').astype('float64')
+    return df
+
+
+# Put the run key columns first, as in the per-run CSV files (Parquet returns partition columns last)
+def _key_columns_first(df: pd.DataFrame) -> pd.DataFrame:
+    keys = [column for column in CATEGORY_COLUMNS if column in df]
+    return df[keys + [column for column in df.columns if column not in keys]]
+
+
+# Sort rows by run key; the row order within each run is kept
+def sort_by_run(df: pd.DataFrame) -> pd.DataFrame:
+    keys = [column for column in CATEGORY_COLUMNS if column in df]
+    return df.sort_values(keys, kind='stable', ignore_index=True) if keys else df
+
+
+def _clear(path: str):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+# Write compiled data in the format given by the path's extension (replacing what is there)
+def write_compiled(df: pd.DataFrame, path: str):
+    fmt = storage_format(path)
+    if fmt == 'csv':
+        df.to_csv(path, index=False)
+        return
+
+    _require_pyarrow(path)
+    df = sort_by_run(to_columnar(df))
+    temp_path = f'{path}.tmp'
+    _clear(temp_path)
+    if fmt == 'parquet':
+        df.to_parquet(temp_path, partition_cols=PARTITION_COLUMNS, index=False)
+    else:
+        df.to_feather(temp_path)
+    replace_compiled(temp_path, path)
+
+
+# Add rows to a partitioned Parquet dataset as a new part file per partition (used for streamed writes)
+def append_parquet(df: pd.DataFrame, path: str, part: int):
+    _require_pyarrow(path)
+    df = sort_by_run(to_columnar(df))
+    df.to_parquet(path, partition_cols=PARTITION_COLUMNS, index=False,
+                  basename_template=f'part-{part:05d}-{{i}}.parquet', existing_data_behavior='overwrite_or_ignore')
+
+
+# Write chunks of compiled data to `path` one at a time, so the data never has to fit in memory
+# (except for Feather, which cannot be appended to); returns the number of rows written
+def write_compiled_chunks(chunks: Iterable[pd.DataFrame], path: str) -> int:
+    fmt = storage_format(path)
+    if fmt == 'feather':
+        frames = list(chunks)
+        df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+        write_compiled(df, path)
+        return len(df)
+
+    temp_path = f'{path}.tmp'
+    _clear(temp_path)
+    rows = 0
+    for part, chunk in enumerate(chunks):
+        if fmt == 'csv':
+            chunk.to_csv(temp_path, mode='a', header=part == 0, index=False)
+        else:
+            append_parquet(chunk, temp_path, part)
+        rows += len(chunk)
+    if not os.path.exists(temp_path):
+        open(temp_path, 'w').close()
+    replace_compiled(temp_path, path)
+    return rows
+
+
+# Read compiled data from CSV, Feather or Parquet; `filters` (Parquet only) prune partitions before reading
+def read_compiled(path: str, columns: Optional[List[str]] = None, filters=None) -> pd.DataFrame:
+    fmt = storage_format(path)
+    if fmt == 'csv':
+        dtype = {column: 'category' for column in ('section', 'run')}
+        df = pd.read_csv(path, usecols=columns, dtype=dtype)
+    else:
+        _require_pyarrow(path)
+        if fmt == 'parquet':
+            df = pd.read_parquet(path, columns=columns, filters=filters)
+        else:
+            df = pd.read_feather(path, columns=columns)
+    df = to_columnar(df)
+    return sort_by_run(_key_columns_first(df)) if fmt == 'parquet' else df
+
+
+# Move a freshly written compiled file or dataset over `path`
+def replace_compiled(source: str, path: str):
+    _clear(path)
+    os.replace(source, path)
+
+
+# Path of the manifest kept next to a compiled file that is compiled incrementally
+def manifest_path(output_path: str) -> str:
+    return f'{output_path}.manifest.json'
+
+
+# SHA-1 of the `TAIL_BYTES` bytes before offset `size` of a file: enough to tell whether the first `size`
+# bytes are still the ones written, since any rewrite of the data changes its last rows
+def tail_sha1(path: str, size: int) -> str:
+    with open(path, 'rb') as f:
+        f.seek(max(size - TAIL_BYTES, 0))
+        return hashlib.sha1(f.read(min(size, TAIL_BYTES))).hexdigest()
+
+
+# Read compiled data in chunks of about `chunksize` rows without loading the whole dataset
+def iter_compiled(path: str, chunksize: int = 500_000) -> Iterator[pd.DataFrame]:
+    fmt = storage_format(path)
+    if fmt == 'csv':
+        for chunk in pd.read_csv(path, chunksize=chunksize):
+            yield chunk
+        return
+
+    _require_pyarrow(path)
+    if fmt == 'feather':
+        yield read_compiled(path)
+        return
+
+    import pyarrow.dataset as ds
+    dataset = ds.dataset(path, format='parquet', partitioning='hive')
+    for batch in dataset.to_batches(batch_size=chunksize):
+        yield _key_columns_first(to_columnar(batch.to_pandas()))
+
+
+# Convert compiled data between formats, e.g. CSV -> Parquet for fast loading, or back to CSV for export
+def main():
+    parser = argparse.ArgumentParser(description="Convert compiled data between CSV, Parquet and Feather.")
+    parser.add_argument('input', help="compiled_data.csv, compiled_data.parquet or compiled_data.feather")
+    parser.add_argument('output', help="Output path; the format follows the extension")
+    args = parser.parse_args()
+
+    df = read_compiled(args.input)
+    write_compiled(df, args.output)
+    print(f"Converted {len(df)} rows from '{args.input}' to '{args.output}'")
+
+
+if __name__ == "__main__":
+    main()
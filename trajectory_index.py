@@ -0,0 +1,76 @@
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+RUN_KEY = ['section', 'v_flow', 'run']
+
+
+# Normalise a run key so keys read from CSV, Parquet and selection files compare equal
+def run_key(section, v_flow, run) -> Tuple:
+    v_flow = int(v_flow) if str(v_flow).lstrip('-').isdigit() else v_flow
+    return str(section), v_flow, str(run)
+
+
+# Index of the trajectories in compiled data, built once. The rows are sorted (stably, so each run keeps
+# its point order) by section, v_flow and run, and the start/end offset of every run is stored, so a run
+# lookup is a dict lookup plus a zero-copy slice instead of a boolean mask over the whole DataFrame.
+class TrajectoryIndex:
+    def __init__(self, df: pd.DataFrame):
+        df = df.dropna(subset=RUN_KEY)
+        self.df = df.sort_values(RUN_KEY, kind='stable', ignore_index=True)
+        self.x = self.df['x'].to_numpy(dtype=np.float64)
+        self.y = self.df['y'].to_numpy(dtype=np.float64)
+
+        # Offsets where any key column changes value
+        n = len(self.df)
+        changes = np.zeros(n, dtype=bool)
+        if n:
+            changes[0] = True
+            for column in RUN_KEY:
+                values = self.df[column].to_numpy()
+                changes[1:] |= values[1:] != values[:-1]
+        starts = np.flatnonzero(changes)
+        ends = np.append(starts[1:], n)
+        self.starts = starts  # Row offsets of every run, in sorted order
+        self.ends = ends
+        self.keys: List[Tuple] = []
+
+        self.slices: Dict[Tuple, Tuple[int, int]] = {}
+        self.cache: Dict = {}  # Data derived per run (e.g. decimated points), keyed by its producer
+        self.cells: Dict[Tuple, List[Tuple]] = {}
+        keys = self.df[RUN_KEY].iloc[starts].itertuples(index=False, name=None)
+        for key, start, end in zip(keys, starts.tolist(), ends.tolist()):
+            key = run_key(*key)
+            self.keys.append(key)
+            self.slices[key] = (start, end)
+            self.cells.setdefault(key[:2], []).append(key)
+
+        self.sections = sorted({section for section, _ in self.cells})
+        self.v_flows = sorted({v_flow for _, v_flow in self.cells}, key=lambda v: (isinstance(v, str), v))
+
+    def __len__(self) -> int:
+        return len(self.slices)
+
+    def __contains__(self, key) -> bool:
+        return run_key(*key) in self.slices
+
+    # Rows of one run, or None if the run is not in the data
+    def run(self, section, v_flow, run) -> Optional[pd.DataFrame]:
+        bounds = self.slices.get(run_key(section, v_flow, run))
+        return None if bounds is None else self.df.iloc[bounds[0]:bounds[1]]
+
+    # x and y arrays of one run (views into the index), or None if the run is not in the data
+    def xy(self, key: Tuple) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        bounds = self.slices.get(run_key(*key))
+        if bounds is None:
+            return None
+        start, end = bounds
+        return self.x[start:end], self.y[start:end]
+
+    # Keys of the runs of one (section, v_flow) cell; all of them, or only those in `runs`
+    def cell(self, section, v_flow, runs: Optional[List[str]] = None) -> List[Tuple]:
+        keys = self.cells.get(run_key(section, v_flow, '')[:2], [])
+        if runs is None:
+            return keys
+        return [key for key in (run_key(section, v_flow, run) for run in runs) if key in self.slices]
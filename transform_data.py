@@ -1,10 +1,117 @@
 import pandas as pd
 import numpy as np
+import argparse
+import glob
+import hashlib
+import json
 import os
 import shutil
 import stat
+from typing import Optional
+
+from storage import iter_compiled, manifest_path, replace_compiled, write_compiled_chunks
+
+RUN_KEY = ['section', 'v_flow', 'run']
+
+# Settings used when the config file does not exist yet (it is created with these values)
+DEFAULT_CONFIG = {
+    # File paths (CSV, or .parquet/.feather for the columnar formats)
+    'original_filepath': 'compiled_data.csv',
+    'backup_filepath': 'compiled_data_original.csv',
+    'transformed_filepath': 'compiled_data_transformed.csv',
+    'cache_folder': 'transform_cache',  # Results cached by hash of (input content, parameters)
+    'cache_entries': 4,                 # Most recently used results kept in the cache (older ones are deleted)
+    'chunksize': 500000,                # Rows transformed at a time
+    # Transformation parameters (adjust as needed)
+    'parameters': {
+        'flip_x': True,                 # Flip x axis
+        'flip_y': False,                # Flip y axis
+        'shift_x_by': -100,             # Shift x by -100
+        'shift_y_by': 50,               # Shift y by 50
+        'rotate_deg': 45,               # Rotate by 45 degrees
+        'rotate_rad': 0,                # Rotate by an angle in radians (set to 0 if using degrees)
+        'video_flip_x': False,          # Flip x axis based on video width
+        'video_flip_y': True,           # Flip y axis based on video height
+        'video_width': 1920,            # Width of the video (used if video_flip_x is True)
+        'video_height': 1080,           # Height of the video (used if video_flip_y is True)
+        'adjust_run_timestamp_to_0': True,  # Adjust each run to start at timestamp 0
+    },
+}
+
+
+# Combine the geometric steps into one 3x3 homogeneous matrix acting on column vectors (x, y, 1),
+# composed in the same order the steps were always applied: video flip, axis flip, shift, rotation
+def affine_matrix(flip_x: bool = False,
+                  flip_y: bool = False,
+                  shift_x_by: float = 0,
+                  shift_y_by: float = 0,
+                  rotate_deg: float = 0,
+                  rotate_rad: float = 0,
+                  video_flip_x: bool = False,
+                  video_flip_y: bool = False,
+                  video_width: float = None,
+                  video_height: float = None) -> np.ndarray:
+    matrix = np.eye(3)
+
+    # Step 1: Video-based flipping (using video width and height)
+    if video_flip_x and video_width is not None:
+        matrix = np.array([[-1, 0, video_width], [0, 1, 0], [0, 0, 1]]) @ matrix
+    if video_flip_y and video_height is not None:
+        matrix = np.array([[1, 0, 0], [0, -1, video_height], [0, 0, 1]]) @ matrix
+
+    # Step 2: Flip x and/or y
+    matrix = np.diag([-1 if flip_x else 1, -1 if flip_y else 1, 1]) @ matrix
+
+    # Step 3: Shift x and y by specified amounts
+    matrix = np.array([[1, 0, shift_x_by], [0, 1, shift_y_by], [0, 0, 1]]) @ matrix
+
+    # Step 5: Rotation (convert degrees to radians if needed); points are rotated as row vectors
+    # times [[cos, -sin], [sin, cos]], i.e. x' = x cos + y sin, y' = -x sin + y cos
+    rotation_angle = rotate_rad if rotate_rad != 0 else np.deg2rad(rotate_deg)
+    if rotation_angle != 0:
+        cos_theta = np.cos(rotation_angle)
+        sin_theta = np.sin(rotation_angle)
+        matrix = np.array([[cos_theta, sin_theta, 0], [-sin_theta, cos_theta, 0], [0, 0, 1]]) @ matrix
+
+    return matrix
+
+
+# Apply a homogeneous matrix to the x/y columns in one pass over a contiguous (n, 2) float array
+def apply_affine(df: pd.DataFrame, matrix: np.ndarray) -> pd.DataFrame:
+    if np.array_equal(matrix, np.eye(3)):
+        return df
+    xy = df[['x', 'y']].to_numpy(dtype=np.float64)
+    transformed = np.empty_like(xy)
+    np.matmul(xy, matrix[:2, :2].T, out=transformed)
+    transformed += matrix[:2, 2]
+    df['x'] = transformed[:, 0]
+    df['y'] = transformed[:, 1]
+    return df
+
+
+# Shift each run's timestamps so its first row is at 0, in one vectorized group-wise subtraction.
+# Rows with a missing run key are left as they are. When transforming in chunks, pass the same
+# `first_timestamps` dict to every chunk so runs spanning chunks keep the offset of their first row.
+def zero_run_timestamps(df: pd.DataFrame, first_timestamps: Optional[dict] = None) -> pd.DataFrame:
+    # Groups are numbered 0..n-1 in order of first appearance; rows with a missing key get no number
+    codes = df.groupby(RUN_KEY, sort=False, observed=True).ngroup().fillna(-1).to_numpy(dtype=np.int64)
+    valid = codes >= 0
+    timestamps = df['timestamp'].to_numpy(dtype=np.float64)
+    rows = np.flatnonzero(valid)
+    _, first_rows = np.unique(codes[rows], return_index=True)  # First occurrence of each group
+    group_first = timestamps[rows[first_rows]]
+    if first_timestamps is not None:
+        keys = df[RUN_KEY].iloc[rows[first_rows]].itertuples(index=False, name=None)
+        group_first = np.array([first_timestamps.setdefault(key, first) for key, first in zip(keys, group_first)],
+                               dtype=np.float64)
+    offsets = np.zeros(len(df))
+    offsets[rows] = group_first[codes[rows]]
+    df['timestamp'] = timestamps - offsets
+    return df
+
 
 # Function to perform transformations on x, y data
+# The geometric steps are fused into one matrix; `copy=False` transforms `df` itself instead of a copy.
 def transform_data(df: pd.DataFrame,
                    flip_x: bool = False,
                    flip_y: bool = False,
@@ -16,48 +123,97 @@ def transform_data(df: pd.DataFrame,
                    video_flip_y: bool = False,
                    video_width: float = None,
                    video_height: float = None,
-                   adjust_run_timestamp_to_0: bool = False) -> pd.DataFrame:
-    # Step 1: Video-based flipping (using video width and height)
-    if video_flip_x and video_width is not None:
-        df['x'] = video_width - df['x']
-    if video_flip_y and video_height is not None:
-        df['y'] = video_height - df['y']
+                   adjust_run_timestamp_to_0: bool = False,
+                   copy: bool = True) -> pd.DataFrame:
+    if copy:
+        df = df.copy()
 
-    # Step 2: Flip x and/or y
-    if flip_x:
-        df['x'] = -df['x']
-    if flip_y:
-        df['y'] = -df['y']
-
-    # Step 3: Shift x and y by specified amounts
-    df['x'] += shift_x_by
-    df['y'] += shift_y_by
+    # Steps 1-3 and 5: flips, shift and rotation in a single matrix product
+    matrix = affine_matrix(flip_x, flip_y, shift_x_by, shift_y_by, rotate_deg, rotate_rad,
+                           video_flip_x, video_flip_y, video_width, video_height)
+    apply_affine(df, matrix)
 
     # Step 4: Adjust timestamps for each unique combination of experiment, v_flow, and run to start from zero if requested
     if adjust_run_timestamp_to_0:
-        for (experiment, v_flow, run), group_df in df.groupby(['section', 'v_flow', 'run']):
-            df.loc[group_df.index, 'timestamp'] -= group_df['timestamp'].iloc[0]
+        zero_run_timestamps(df)
 
-    # Step 5: Rotation (convert degrees to radians if needed)
-    rotation_angle = rotate_rad if rotate_rad != 0 else np.deg2rad(rotate_deg)
-    if rotation_angle != 0:
-        # Create rotation matrix
-        cos_theta = np.cos(rotation_angle)
-        sin_theta = np.sin(rotation_angle)
-        rotation_matrix = np.array([[cos_theta, -sin_theta], [sin_theta, cos_theta]])
+    return df
 
-        # Apply rotation
-        xy_rotated = np.dot(df[['x', 'y']], rotation_matrix)
-        df['x'], df['y'] = xy_rotated[:, 0], xy_rotated[:, 1]
+# Load the settings from `config_path`, creating the file with the defaults if it does not exist yet
+def load_config(config_path: str) -> dict:
+    if not os.path.exists(config_path):
+        with open(config_path, 'w') as f:
+            json.dump(DEFAULT_CONFIG, f, indent=4)
+        print(f"Default transformation settings written to '{config_path}'")
+    with open(config_path) as f:
+        config = json.load(f)
+    return {**DEFAULT_CONFIG, **config,
+            'parameters': {**DEFAULT_CONFIG['parameters'], **config.get('parameters', {})}}
 
-    return df
 
-# Main function to handle file operations and transformations
-def main():
-    # File paths
-    original_filepath = 'compiled_data.csv'
-    backup_filepath = 'compiled_data_original.csv'
-    transformed_filepath = 'compiled_data_transformed.csv'
+# Cache key: hash of the input's content (every part file of a Parquet dataset) and the parameters
+def cache_key(input_filepath: str, parameters: dict) -> str:
+    digest = hashlib.sha256()
+    if os.path.isdir(input_filepath):
+        file_paths = sorted(glob.glob(os.path.join(input_filepath, '**', '*.parquet'), recursive=True))
+    else:
+        file_paths = [input_filepath]
+    for file_path in file_paths:
+        digest.update(os.path.relpath(file_path, input_filepath).encode())
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    digest.update(json.dumps(parameters, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+# Transform `input_filepath` into `output_filepath` one chunk at a time; returns the number of rows
+def transform_file(input_filepath: str, output_filepath: str, parameters: dict, chunksize: int = 500000) -> int:
+    parameters = dict(parameters)
+    adjust_run_timestamp_to_0 = parameters.pop('adjust_run_timestamp_to_0', False)
+    matrix = affine_matrix(**parameters)
+    first_timestamps = {}  # First timestamp of every run seen so far, carried across chunks
+
+    def transformed_chunks():
+        for chunk in iter_compiled(input_filepath, chunksize):
+            apply_affine(chunk, matrix)
+            if adjust_run_timestamp_to_0:
+                zero_run_timestamps(chunk, first_timestamps)
+            yield chunk
+
+    return write_compiled_chunks(transformed_chunks(), output_filepath)
+
+
+# Delete all but the `keep` most recently used results in the cache folder; returns how many were deleted.
+# Using a cached result touches it, so results that keep being reused stay.
+def prune_cache(cache_folder: str, keep: int) -> int:
+    if not os.path.isdir(cache_folder):
+        return 0
+    entries = sorted((os.path.join(cache_folder, name) for name in os.listdir(cache_folder)),
+                     key=os.path.getmtime, reverse=True)
+    for path in entries[keep:]:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    return len(entries[keep:])
+
+
+# Transform the compiled data as set up in the config file: back up, transform (or reuse the cached
+# result) and replace the original
+def transform(config_path: str = 'transform_config.json'):
+    config = load_config(config_path)
+    original_filepath = config['original_filepath']
+    backup_filepath = config['backup_filepath']
+    transformed_filepath = config['transformed_filepath']
+
+    # An incremental compile keeps appending untransformed rows to its output, so transforming that file
+    # in place would mix transformed and untransformed rows
+    if os.path.exists(manifest_path(original_filepath)):
+        print(f"'{original_filepath}' is kept up to date by an incremental compile "
+              f"('{manifest_path(original_filepath)}'), so it is not transformed in place. Point "
+              f"'original_filepath' at a copy or at a non-incremental compile, or delete the manifest.")
+        return
 
     # Step 1: Check if backup file exists, if not create it
     if os.path.exists(backup_filepath):
@@ -66,48 +222,57 @@ def main():
         print(f"Using existing backup file: '{backup_filepath}'")
     else:
         # Create backup from the original file and make it read-only
-        shutil.copyfile(original_filepath, backup_filepath)
-        os.chmod(backup_filepath, stat.S_IREAD)
+        if os.path.isdir(original_filepath):
+            shutil.copytree(original_filepath, backup_filepath)  # Partitioned Parquet dataset
+        else:
+            shutil.copyfile(original_filepath, backup_filepath)
+            os.chmod(backup_filepath, stat.S_IREAD)
         input_filepath = original_filepath
         print(f"Backup created: '{backup_filepath}' (set as read-only)")
 
-    # Load the data from the chosen file (either backup or original)
-    df = pd.read_csv(input_filepath)
-
-    # Transformation parameters (adjust as needed)
-    flip_x = True                  # Flip x axis
-    flip_y = False                 # Flip y axis
-    shift_x_by = -100              # Shift x by -100
-    shift_y_by = 50                # Shift y by 50
-    rotate_deg = 45                # Rotate by 45 degrees
-    rotate_rad = 0                 # Rotate by an angle in radians (set to 0 if using degrees)
-    video_flip_x = False           # Flip x axis based on video width
-    video_flip_y = True            # Flip y axis based on video height
-    video_width = 1920             # Width of the video (used if video_flip_x is True)
-    video_height = 1080            # Height of the video (used if video_flip_y is True)
-    adjust_run_timestamp_to_0 = True  # Adjust each run to start at timestamp 0
-
-
-
-    # Step 2: Apply transformations
-    df_transformed = transform_data(df,
-                                    flip_x=flip_x,
-                                    flip_y=flip_y,
-                                    shift_x_by=shift_x_by,
-                                    shift_y_by=shift_y_by,
-                                    rotate_deg=rotate_deg,
-                                    rotate_rad=rotate_rad,
-                                    video_flip_x=video_flip_x,
-                                    video_flip_y=video_flip_y,
-                                    video_width=video_width,
-                                    video_height=video_height,
-                                    adjust_run_timestamp_to_0=adjust_run_timestamp_to_0)
+    # Step 2: Apply transformations, unless this input was already transformed with these parameters
+    parameters = config['parameters']
+    os.makedirs(config['cache_folder'], exist_ok=True)
+    extension = os.path.splitext(original_filepath.rstrip('/\\'))[1] or '.csv'
+    cached_filepath = os.path.join(config['cache_folder'], cache_key(input_filepath, parameters) + extension)
+    if os.path.exists(cached_filepath):
+        os.utime(cached_filepath)  # Mark as recently used
+        print(f"Using cached transformation: '{cached_filepath}'")
+    else:
+        rows = transform_file(input_filepath, cached_filepath, parameters, config['chunksize'])
+        print(f"Transformed {rows} rows into cache: '{cached_filepath}'")
+    pruned = prune_cache(config['cache_folder'], max(config['cache_entries'], 1))
+    if pruned:
+        print(f"Removed {pruned} old result(s) from '{config['cache_folder']}'")
 
     # Step 3: Save the transformed data to a new file and replace original file
-    df_transformed.to_csv(transformed_filepath, index=False)
-    shutil.move(transformed_filepath, original_filepath)
+    if os.path.isdir(transformed_filepath):
+        shutil.rmtree(transformed_filepath)  # Left over from an interrupted run
+    elif os.path.exists(transformed_filepath):
+        os.remove(transformed_filepath)
+    # Copied rather than linked, so nothing that later writes to the data file can change the cached result
+    if os.path.isdir(cached_filepath):
+        shutil.copytree(cached_filepath, transformed_filepath)
+    else:
+        shutil.copyfile(cached_filepath, transformed_filepath)
+    replace_compiled(transformed_filepath, original_filepath)
+
+    print(f"Transformation complete. Original data saved as '{backup_filepath}' (read-only), and transformed data saved as '{original_filepath}'.")
+
+def main():
+    parser = argparse.ArgumentParser(description="Transform compiled data using the settings in a JSON config file.")
+    parser.add_argument('--config', default='transform_config.json',
+                        help="Settings file (created with defaults if missing)")
+    parser.add_argument('--clear-cache', action='store_true',
+                        help="Delete every cached result in the config's cache folder and exit")
+    args = parser.parse_args()
+
+    if args.clear_cache:
+        cache_folder = load_config(args.config)['cache_folder']
+        print(f"Removed {prune_cache(cache_folder, 0)} cached result(s) from '{cache_folder}'")
+    else:
+        transform(args.config)
 
-    print("Transformation complete. Original data saved as 'compiled_data_original.csv' (read-only), and transformed data saved as 'compiled_data.csv'.")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,150 @@
+import math
+from typing import Callable, Hashable, Tuple
+
+import cv2
+import numpy as np
+
+
+# Fixed-size display window onto the video: crops the visible region of the source frame first
+# and scales only that crop into a preallocated buffer. Zoom 1.0 fits the whole frame.
+# Coordinates are always source-video pixels; `render` also accepts frames at another resolution
+# (e.g. from a low-resolution proxy) and maps them onto the same view.
+class Viewport:
+    def __init__(self, frame_width: int, frame_height: int, max_size: Tuple[int, int] = (1280, 720)):
+        self.frame_width = frame_width
+        self.frame_height = frame_height
+        # Size the window to the frame's aspect ratio, never enlarging footage smaller than `max_size`
+        self.fit = min(max_size[0] / frame_width, max_size[1] / frame_height, 1.0)
+        self.width = max(int(round(frame_width * self.fit)), 1)
+        self.height = max(int(round(frame_height * self.fit)), 1)
+        self.buffer = np.zeros((self.height, self.width, 3), np.uint8)
+
+        self.zoom = 1.0
+        self.center_x = frame_width / 2  # Source pixel shown in the middle of the viewport
+        self.center_y = frame_height / 2
+        self.version = 0  # Bumped whenever the source <-> view mapping changes
+        self._update_geometry()
+
+    # Display pixels per source pixel
+    @property
+    def scale(self) -> float:
+        return self.fit * self.zoom
+
+    def set_zoom(self, zoom: float):
+        if zoom != self.zoom:
+            self.zoom = zoom
+            self._update_geometry()
+
+    # Move the view by a distance given in viewport pixels
+    def pan(self, dx: float, dy: float):
+        self.center_x += dx / self.scale
+        self.center_y += dy / self.scale
+        self._update_geometry()
+
+    def reset(self):
+        self.zoom = 1.0
+        self.center_x = self.frame_width / 2
+        self.center_y = self.frame_height / 2
+        self._update_geometry()
+
+    # Work out the source region of interest and where its scaled copy lands in the buffer
+    def _update_geometry(self):
+        scale = self.scale
+        roi_w = min(self.frame_width, self.width / scale)
+        roi_h = min(self.frame_height, self.height / scale)
+
+        # Keep the view inside the frame
+        self.center_x = min(max(self.center_x, roi_w / 2), self.frame_width - roi_w / 2)
+        self.center_y = min(max(self.center_y, roi_h / 2), self.frame_height - roi_h / 2)
+
+        x0 = max(int(math.floor(self.center_x - roi_w / 2)), 0)
+        y0 = max(int(math.floor(self.center_y - roi_h / 2)), 0)
+        x1 = min(int(math.ceil(x0 + roi_w)), self.frame_width)
+        y1 = min(int(math.ceil(y0 + roi_h)), self.frame_height)
+
+        # Destination rectangle; smaller than the buffer (letterboxed) when zoomed out below fit
+        dest_w = min(max(int(round((x1 - x0) * scale)), 1), self.width)
+        dest_h = min(max(int(round((y1 - y0) * scale)), 1), self.height)
+        dx0 = (self.width - dest_w) // 2
+        dy0 = (self.height - dest_h) // 2
+
+        geometry = (x0, y0, x1, y1, dx0, dy0, dest_w, dest_h)
+        if geometry != getattr(self, '_geometry', None):
+            self._geometry = geometry
+            self.buffer[:] = 0  # Clear letterbox borders left over from the previous geometry
+            self.version += 1
+
+    # Blank the letterbox borders around the destination rectangle. Text drawn onto the returned buffer
+    # (time, overlay, HUD) can land there and would otherwise pile up from frame to frame.
+    def _clear_letterbox(self):
+        _, _, _, _, dx0, dy0, dest_w, dest_h = self._geometry
+        if dest_h < self.height:
+            self.buffer[:dy0] = 0
+            self.buffer[dy0 + dest_h:] = 0
+        if dest_w < self.width:
+            self.buffer[dy0:dy0 + dest_h, :dx0] = 0
+            self.buffer[dy0:dy0 + dest_h, dx0 + dest_w:] = 0
+
+    # Crop and scale `frame` into the viewport buffer and return the buffer
+    def render(self, frame: np.ndarray) -> np.ndarray:
+        x0, y0, x1, y1, dx0, dy0, dest_w, dest_h = self._geometry
+        self._clear_letterbox()
+        dst = self.buffer[dy0:dy0 + dest_h, dx0:dx0 + dest_w]
+        if frame.shape[1] == self.frame_width:
+            interpolation = cv2.INTER_LINEAR if self.scale >= 1 else cv2.INTER_AREA
+            cv2.resize(frame[y0:y1, x0:x1], (dest_w, dest_h), dst=dst, interpolation=interpolation)
+            return self.buffer
+
+        # Frame at another resolution: sample it at the exact image position of every view pixel, so
+        # the picture lines up with `to_source`/`to_view` without rounding the crop to image pixels
+        sx = frame.shape[1] / self.frame_width
+        sy = frame.shape[0] / self.frame_height
+        kx = (x1 - x0) / dest_w * sx
+        ky = (y1 - y0) / dest_h * sy
+        inverse = np.float32([[kx, 0, sx * x0 + 0.5 * kx - 0.5], [0, ky, sy * y0 + 0.5 * ky - 0.5]])
+        cv2.warpAffine(frame, inverse, (dest_w, dest_h), dst=dst,
+                       flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP, borderMode=cv2.BORDER_REPLICATE)
+        return self.buffer
+
+    # True if a viewport pixel shows the video, i.e. is not in the letterbox borders around it
+    def contains(self, x: float, y: float) -> bool:
+        _, _, _, _, dx0, dy0, dest_w, dest_h = self._geometry
+        return dx0 <= x < dx0 + dest_w and dy0 <= y < dy0 + dest_h
+
+    # Map a viewport pixel to source-video pixel coordinates
+    def to_source(self, x: float, y: float) -> Tuple[float, float]:
+        x0, y0, x1, y1, dx0, dy0, dest_w, dest_h = self._geometry
+        return (x0 + (x - dx0 + 0.5) * (x1 - x0) / dest_w - 0.5,
+                y0 + (y - dy0 + 0.5) * (y1 - y0) / dest_h - 0.5)
+
+    # Map source-video pixel coordinates to the nearest viewport pixel
+    def to_view(self, x: float, y: float) -> Tuple[int, int]:
+        x0, y0, x1, y1, dx0, dy0, dest_w, dest_h = self._geometry
+        return (int(round(dx0 + (x - x0 + 0.5) * dest_w / (x1 - x0) - 0.5)),
+                int(round(dy0 + (y - y0 + 0.5) * dest_h / (y1 - y0) - 0.5)))
+
+
+# Cached layer of text and markers composited over the viewport. It is only re-rendered when
+# its key (e.g. data version, status text, viewport version) changes.
+class OverlayLayer:
+    def __init__(self, width: int, height: int):
+        self.image = np.zeros((height, width, 3), np.uint8)
+        self.mask = np.zeros((height, width), np.uint8)
+        self._key = None
+        self._bbox = (0, 0, 0, 0)  # Region that actually holds overlay pixels
+
+    # Redraw the layer with `draw(image)` if `key` differs from the one it was last drawn for
+    def update(self, key: Hashable, draw: Callable[[np.ndarray], None]):
+        if key == self._key:
+            return
+        self._key = key
+        self.image[:] = 0
+        draw(self.image)
+        np.multiply(self.image.max(axis=2) > 0, 255, out=self.mask, casting='unsafe')
+        self._bbox = cv2.boundingRect(self.mask)
+
+    # Composite the layer onto `dst`, touching only the region that holds overlay pixels
+    def apply(self, dst: np.ndarray):
+        x, y, w, h = self._bbox
+        if w and h:
+            cv2.copyTo(self.image[y:y + h, x:x + w], self.mask[y:y + h, x:x + w], dst[y:y + h, x:x + w])